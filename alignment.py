@@ -0,0 +1,164 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: alignment.py : python script with the cross exchange alignment of the orderbooks            -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import numpy as np
+import pandas as pd
+
+import data as dt
+import functions
+
+
+def load_venues(path: str = dt.filename, exchanges: list = None, start=None, end=None):
+    """
+    Snapshots of several exchanges of one orderbooks file, by exchange (see
+    data.load_orderbooks for the time range).
+    """
+    exchanges = ["bitfinex", "kraken"] if exchanges is None else exchanges
+    return {i_exchange: dt.load_orderbooks(path, i_exchange, start, end) for i_exchange in exchanges}
+
+
+def venue_metrics(orderbooks=None):
+    """
+    df_metrics of one exchange plus its top of the book (Bid, Ask, Bid Size and Ask Size).
+    """
+    ob_df, _, _ = functions.df_metrics(orderbooks)
+    starts = orderbooks.offsets[:-1]
+    ob_df.insert(0, "Bid", orderbooks.bid[starts])
+    ob_df.insert(1, "Ask", orderbooks.ask[starts])
+    ob_df.insert(2, "Bid Size", orderbooks.bid_size[starts])
+    ob_df.insert(3, "Ask Size", orderbooks.ask_size[starts])
+    return ob_df
+
+
+def _ns(index: pd.DatetimeIndex = None):
+    # int64 nanoseconds (UTC for timezone aware indexes) of a DatetimeIndex
+    return pd.DatetimeIndex(index).values.astype("datetime64[ns]").view(np.int64)
+
+
+def align_venues(venues: dict = None, tolerance: str = None):
+    """
+    As-of alignment of several exchanges
+    Puts the metrics of every exchange on a common timeline, the union of all their
+    snapshot timestamps: at every time, each exchange shows its last snapshot at or before
+    it. The timeline is a stable merge of the already sorted timestamps and the as-of
+    positions of every exchange come from one searchsorted, so no row is visited in Python.
+
+    Parameters
+    ----------
+    venues (dict) : OrderBooks (or venue_metrics DataFrames) by exchange, such as load_venues()
+    tolerance (str) : Oldest snapshot shown, such as "5s" (stale quotes become NaN), None
+    to always show the last one
+
+    Returns
+    -------
+    aligned_df (DataFrame) : Metrics of every exchange, columns indexed by (exchange, metric)
+    """
+    metrics = {i_venue: i_value if isinstance(i_value, pd.DataFrame) else venue_metrics(i_value)
+               for i_venue, i_value in venues.items()}
+    stamps = {i_venue: _ns(i_df.index) for i_venue, i_df in metrics.items()}
+    # Stable sort of concatenated sorted runs, then one entry per distinct time
+    timeline = np.concatenate(list(stamps.values()))
+    timeline = timeline[np.argsort(timeline, kind="stable")]
+    if len(timeline):
+        timeline = timeline[np.concatenate([[True], timeline[1:] != timeline[:-1]])]
+
+    frames = {}
+    for i_venue, i_df in metrics.items():
+        positions = np.searchsorted(stamps[i_venue], timeline, side="right") - 1
+        valid = positions >= 0
+        if tolerance is not None:
+            valid &= timeline - stamps[i_venue][np.maximum(positions, 0)] <= pd.Timedelta(tolerance).value
+        values = i_df.to_numpy(dtype=np.float64)[np.maximum(positions, 0)]
+        values[~valid] = np.nan
+        frames[i_venue] = pd.DataFrame(values, columns=i_df.columns)
+        # Age of the quote shown, in milliseconds
+        frames[i_venue]["Age (ms)"] = np.where(valid, (timeline - stamps[i_venue][np.maximum(positions, 0)])/1e6,
+                                               np.nan)
+
+    index = pd.DatetimeIndex(timeline.astype("datetime64[ns]"))
+    tz = next((i_df.index.tz for i_df in metrics.values()), None)
+    if tz is not None:
+        index = index.tz_localize("UTC").tz_convert(tz)
+    aligned_df = pd.concat(frames, axis=1)
+    aligned_df.index = index
+    return aligned_df
+
+
+def consolidated_bbo(aligned_df: pd.DataFrame = None):
+    """
+    Consolidated best bid and offer
+    Best bid (highest) and best ask (lowest) across the exchanges at every time of the
+    aligned timeline, the exchange quoting each one and the consolidated spread and mid
+    price. A negative Consolidated Spread is a crossed market (buying on one exchange
+    and selling on another is profitable). Cross Spread (A/B) is the ask of A minus the
+    bid of B, for every pair of exchanges.
+
+    Parameters
+    ----------
+    aligned_df (DataFrame) : Output of align_venues
+
+    Returns
+    -------
+    bbo_df (DataFrame) : Consolidated quotes of every time of the timeline
+    """
+    venues = list(aligned_df.columns.get_level_values(0).unique())
+    bids = aligned_df.xs("Bid", axis=1, level=1)[venues].to_numpy()
+    asks = aligned_df.xs("Ask", axis=1, level=1)[venues].to_numpy()
+    has_bid, has_ask = ~np.isnan(bids).all(axis=1), ~np.isnan(asks).all(axis=1)
+    best_bid_pos = np.argmax(np.where(np.isnan(bids), -np.inf, bids), axis=1)
+    best_ask_pos = np.argmin(np.where(np.isnan(asks), np.inf, asks), axis=1)
+    rows = np.arange(len(aligned_df))
+    best_bid = np.where(has_bid, bids[rows, best_bid_pos], np.nan)
+    best_ask = np.where(has_ask, asks[rows, best_ask_pos], np.nan)
+    venue_names = np.array(venues, dtype=object)
+
+    bbo_df = pd.DataFrame({
+        "Best Bid" : best_bid,
+        "Best Bid Venue" : np.where(has_bid, venue_names[best_bid_pos], None),
+        "Best Ask" : best_ask,
+        "Best Ask Venue" : np.where(has_ask, venue_names[best_ask_pos], None),
+        "Consolidated Spread" : best_ask - best_bid,
+        "Consolidated Mid" : (best_ask + best_bid)*0.5,
+        "Crossed" : best_ask < best_bid,
+        "Venues" : (~np.isnan(bids) & ~np.isnan(asks)).sum(axis=1)
+    }, index=aligned_df.index)
+    for i_a, i_venue_a in enumerate(venues):
+        for i_b, i_venue_b in enumerate(venues):
+            if i_a != i_b:
+                bbo_df["Cross Spread ({}/{})".format(i_venue_a, i_venue_b)] = asks[:, i_a] - bids[:, i_b]
+    return bbo_df
+
+
+def lead_lag(aligned_df: pd.DataFrame = None, venue_a: str = None, venue_b: str = None,
+             column: str = "Mid Price", max_lag: int = 10):
+    """
+    Lead-lag of two exchanges
+    Correlation of the changes of column of venue_a at time t with those of venue_b at
+    time t + lag, over the aligned timeline, for lags -max_lag..max_lag. A peak at a
+    positive lag means venue_a moves first.
+
+    Returns
+    -------
+    lead_lag_df (DataFrame) : Correlation and number of pairs of every lag
+    """
+    x = np.diff(aligned_df[(venue_a, column)].to_numpy(dtype=np.float64))
+    y = np.diff(aligned_df[(venue_b, column)].to_numpy(dtype=np.float64))
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlations, pairs = [], []
+    for i_lag in lags:
+        a = x[:len(x) - i_lag] if i_lag >= 0 else x[-i_lag:]
+        b = y[i_lag:] if i_lag >= 0 else y[:len(y) + i_lag]
+        valid = ~(np.isnan(a) | np.isnan(b))
+        a, b = a[valid], b[valid]
+        pairs.append(len(a))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlations.append(np.corrcoef(a, b)[0, 1] if len(a) > 1 else np.nan)
+    return pd.DataFrame({"Correlation": correlations, "Pairs": pairs}, index=pd.Index(lags, name="lag"))
@@ -0,0 +1,168 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: batch.py : python script to run the models over many files and exchanges                    -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import data as dt
+import functions
+
+
+def run_pipeline(path: str = None, exchange: str = "bitfinex"):
+    """
+    Runs df_metrics, Model1_E1, Model1_E2, Model1_E3 and Model2 over one exchange of one
+    orderbooks file. It is the unit of work of run_batch, so it only returns the small
+    result tables and not the per snapshot ones.
+
+    Parameters
+    ----------
+    path (str) : Location of the orderbooks JSON file
+    exchange (str) : Top level key of the exchange to evaluate
+
+    Returns
+    -------
+    summary (dict) : One row of the batch summary
+    tables (dict) : Result tables of every model, by name
+    """
+    data_ob = dt.load_orderbooks(path, exchange)
+    ob_df, m1, m4 = functions.df_metrics(data_ob)
+    midprices = ob_df["Mid Price"]
+
+    APT_df = functions.Model1_E1(midprices)
+    _, APT_results_df = functions.Model1_E2(midprices)
+    WAPT_df, _, WAPT_results_df = functions.Model1_E3(ob_df)
+    _, roll_df_stats = functions.Model2(pd.DataFrame(midprices), ob_df)
+
+    summary = {
+        "Snapshots": len(ob_df),
+        "Median Time (ms)": m1,
+        "Mean Price Levels": np.mean(m4) if len(m4) else np.nan,
+        "Mean Spread": ob_df["Spread"].mean(),
+        "E1 Ratio": APT_df.loc["e1", "ratio"],
+        "E1 Minute Ratio Mean": APT_results_df["E1 Ratio Mean"].iloc[0],
+        "W E1 Ratio": WAPT_df.loc["e1", "ratio"],
+        "W E1 Minute Ratio Mean": WAPT_results_df["E1 Ratio Mean"].iloc[0],
+        "Calculated Spread": roll_df_stats["Calculated Spread"].iloc[0],
+        "Spread Difference": roll_df_stats["Spread Difference"].iloc[0],
+    }
+    tables = {"APT": APT_df, "APT_results": APT_results_df, "WAPT": WAPT_df,
+              "WAPT_results": WAPT_results_df, "Roll_stats": roll_df_stats}
+    return summary, tables
+
+
+def file_labels(files: list = None):
+    """
+    Labels of the orderbooks files in the results: their path relative to the folder all
+    of them are in (the file name when they share a folder), so files with the same name
+    in different folders are told apart. A file given more than once raises a ValueError.
+
+    Parameters
+    ----------
+    files (list) : Locations of the orderbooks JSON files
+
+    Returns
+    -------
+    labels (dict) : Label of every file, by location
+    """
+    locations = [os.path.abspath(i_file) for i_file in files]
+    repeated = sorted({i_location for i_location in locations if locations.count(i_location) > 1})
+    if repeated:
+        raise ValueError("Orderbooks files given more than once: {}".format(", ".join(repeated)))
+    if not locations:
+        return {}
+    root = os.path.commonpath([os.path.dirname(i_location) for i_location in locations])
+    return {i_file: os.path.relpath(i_location, root) for i_file, i_location in zip(files, locations)}
+
+
+def run_pairs(func=None, pairs: list = None, max_workers: int = None, **kwargs):
+    """
+    Runs func(path, exchange, **kwargs) for every (file, exchange) pair, in a pool of
+    processes (in this process when max_workers is 1). A pair whose exchange is not in
+    its file does not stop the others, it is reported in errors.
+
+    Parameters
+    ----------
+    func (function) : Unit of work, a module level function so it can be pickled
+    pairs (list) : (file, exchange) pairs
+    max_workers (int) : Number of processes (all the cores by default)
+
+    Returns
+    -------
+    results (dict) : Result of func by pair, in the order of pairs
+    errors (dict) : Error message by pair
+    """
+    results, errors = {}, {}
+
+    def collect(pair, get_result):
+        try:
+            results[pair] = get_result()
+        except KeyError as error:
+            if error.args != (pair[1],):
+                raise
+            errors[pair] = "exchange not found"
+
+    if max_workers == 1:
+        for i_pair in pairs:
+            collect(i_pair, lambda: func(*i_pair, **kwargs))
+        return results, errors
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {i_pair: executor.submit(func, *i_pair, **kwargs) for i_pair in pairs}
+        for i_pair, i_future in futures.items():
+            collect(i_pair, i_future.result)
+    return results, errors
+
+
+def run_batch(pattern: str = "files/orderbooks_*.json", exchanges: list = None, max_workers: int = None):
+    """
+    Batch runner
+    Evaluates every (file, exchange) pair matched by the glob pattern in a pool of
+    processes, one pair per task, and merges the results into tables indexed by file
+    (see file_labels) and exchange. Pairs whose exchange is not in the file are reported
+    in the Error column instead of stopping the batch.
+
+    Parameters
+    ----------
+    pattern (str) : Glob of the orderbooks JSON files
+    exchanges (list) : Exchanges to evaluate in every file (["bitfinex"] by default)
+    max_workers (int) : Number of processes (all the cores by default)
+
+    Returns
+    -------
+    summary_df (DataFrame) : One row per (file, exchange) with the headline results
+    tables (dict) : Each model table concatenated over all (file, exchange) pairs
+    """
+    exchanges = ["bitfinex"] if exchanges is None else list(exchanges)
+    files = sorted(glob.glob(pattern))
+    pairs = [(i_file, i_exchange) for i_file in files for i_exchange in exchanges]
+    labels = file_labels(files)
+
+    rows, tables = {}, {}
+    results, errors = run_pairs(run_pipeline, pairs, max_workers)
+    for i_file, i_exchange in pairs:
+        key = (labels[i_file], i_exchange)
+        if (i_file, i_exchange) in errors:
+            rows[key] = {"Error": errors[(i_file, i_exchange)]}
+            continue
+        summary, i_tables = results[(i_file, i_exchange)]
+        rows[key] = dict(summary, Error=None)
+        for i_name, i_table in i_tables.items():
+            tables.setdefault(i_name, {})[key] = i_table
+
+    summary_df = pd.DataFrame.from_dict(rows, orient="index")
+    summary_df.index = pd.MultiIndex.from_tuples(summary_df.index, names=["file", "exchange"]) \
+        if len(summary_df) else pd.MultiIndex.from_tuples([], names=["file", "exchange"])
+    summary_df = summary_df.sort_index()
+    tables = {i_name: pd.concat(i_tables, names=["file", "exchange"]) for i_name, i_tables in tables.items()}
+    return summary_df, tables
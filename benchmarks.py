@@ -0,0 +1,186 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: benchmarks.py : python script with synthetic orderbooks and model benchmarks                -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import functions
+from data import OrderBooks
+
+
+def synthetic_orderbooks(n_snapshots: int = 10_000, depth: int = 10, tick_size: float = 0.5,
+                         start_price: float = 34000.0, p_change: float = 0.5, volatility: float = 1.0,
+                         mean_interval_ms: float = 1000.0, seed: int = 0,
+                         start: str = "2021-07-05 13:00:00+00:00"):
+    """
+    Synthetic OrderBook generator
+    Builds an OrderBooks store with the same shape data.py produces from the JSON files.
+    The best bid follows a random walk on the tick grid: at every snapshot it moves with
+    probability p_change by a normal number of ticks (std volatility), the spread is one
+    or more ticks and every side has depth levels one tick apart.
+
+    Parameters
+    ----------
+    n_snapshots (int) : Number of snapshots
+    depth (int) : Number of levels on each side of every snapshot
+    tick_size (float) : Price difference between consecutive levels
+    start_price (float) : Best bid of the first snapshot
+    p_change (float) : Probability that the best bid moves between snapshots
+    volatility (float) : Standard deviation of the moves, in ticks
+    mean_interval_ms (float) : Mean time between snapshots (exponential)
+    seed (int) : Seed of the random generator
+    start (str) : Timestamp of the first snapshot
+
+    Returns
+    -------
+    OrderBooks : Columnar store with the synthetic snapshots
+    """
+    rng = np.random.default_rng(seed)
+    # Best bid and spread in ticks
+    moves = np.where(rng.random(n_snapshots) < p_change,
+                     np.round(rng.normal(0, volatility, n_snapshots)), 0).astype(np.int64)
+    moves[0] = 0
+    best_bid = np.round(start_price/tick_size).astype(np.int64) + np.cumsum(moves)
+    spread = rng.geometric(0.7, n_snapshots)
+    levels = np.arange(depth)
+    bid = ((best_bid[:, None] - levels)*tick_size).ravel()
+    ask = ((best_bid[:, None] + spread[:, None] + levels)*tick_size).ravel()
+    bid_size = np.round(rng.exponential(1.0, n_snapshots*depth), 8)
+    ask_size = np.round(rng.exponential(1.0, n_snapshots*depth), 8)
+
+    intervals = np.maximum(np.round(rng.exponential(mean_interval_ms, n_snapshots)), 1).astype(np.int64)
+    intervals[0] = 0
+    start = pd.Timestamp(start)
+    timestamps = start.value + np.cumsum(intervals)*1_000_000
+    offsets = np.arange(n_snapshots + 1, dtype=np.int64)*depth
+    return OrderBooks(timestamps, offsets, bid_size, bid, ask, ask_size, tz=start.tz)
+
+
+def measure(func=None, *args, **kwargs):
+    """
+    Runs func once to time it and once more under tracemalloc to get its peak memory.
+
+    Returns
+    -------
+    seconds (float) : Wall time of the untraced run
+    peak_mb (float) : Peak memory allocated during the traced run, in MB
+    result : Value returned by func
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak/2**20, result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: tuple = (10_000, 100_000, 1_000_000), depth: int = 10, seed: int = 0,
+                   output: str = "files/benchmarks.json"):
+    """
+    Benchmark suite
+    Times df_metrics, Model1_E1, Model1_E2, Model1_E3 and Model2 over synthetic orderbooks
+    of every size, and saves throughput and peak memory with the commit and library
+    versions as JSON, so the results of two commits can be compared with compare_benchmarks.
+
+    Parameters
+    ----------
+    sizes (tuple) : Numbers of snapshots to benchmark
+    depth (int) : Levels on each side of the synthetic snapshots
+    seed (int) : Seed of the synthetic orderbooks
+    output (str) : Location of the JSON results (None to not save them)
+
+    Returns
+    -------
+    results_df (DataFrame) : Seconds, snapshots per second and peak MB by function and size
+    """
+    rows = []
+    for i_size in sizes:
+        books = synthetic_orderbooks(i_size, depth, seed=seed)
+        seconds, peak, (ob_df, _, _) = measure(functions.df_metrics, books)
+        rows.append({"function": "df_metrics", "snapshots": i_size, "seconds": seconds, "peak_mb": peak})
+        midprices = ob_df["Mid Price"]
+        for i_name, i_func, i_args in [
+                ("Model1_E1", functions.Model1_E1, (midprices,)),
+                ("Model1_E2", functions.Model1_E2, (midprices,)),
+                ("Model1_E3", functions.Model1_E3, (ob_df,)),
+                ("Model2", functions.Model2, (pd.DataFrame(midprices), ob_df))]:
+            seconds, peak, _ = measure(i_func, *i_args)
+            rows.append({"function": i_name, "snapshots": i_size, "seconds": seconds, "peak_mb": peak})
+        del books, ob_df, midprices
+
+    results_df = pd.DataFrame(rows)
+    results_df["snapshots_per_s"] = results_df["snapshots"]/results_df["seconds"]
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump({
+                "commit": _git_commit(),
+                "date": pd.Timestamp.now(tz="UTC").isoformat(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "depth": depth,
+                "results": results_df.to_dict(orient="records"),
+            }, file, indent=2)
+    return results_df
+
+
+def compare_benchmarks(base: str = None, head: str = None):
+    """
+    Compares two JSON files saved by run_benchmarks.
+
+    Returns
+    -------
+    compare_df (DataFrame) : Seconds and peak MB of both runs by function and size, with the
+    head/base ratios (above 1 means head is slower or uses more memory)
+    """
+    frames = []
+    for i_file in (base, head):
+        with open(i_file) as file:
+            frames.append(pd.DataFrame(json.load(file)["results"]).set_index(["function", "snapshots"]))
+    compare_df = frames[0][["seconds", "peak_mb"]].join(frames[1][["seconds", "peak_mb"]],
+                                                         lsuffix=" base", rsuffix=" head", how="inner")
+    compare_df["time ratio"] = compare_df["seconds head"]/compare_df["seconds base"]
+    compare_df["memory ratio"] = compare_df["peak_mb head"]/compare_df["peak_mb base"]
+    return compare_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the Lab 2 models over synthetic orderbooks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="files/benchmarks.json")
+    parser.add_argument("--compare", metavar="BASE_JSON", help="Compare the new results against a previous run")
+    args = parser.parse_args()
+
+    print(run_benchmarks(args.sizes, args.depth, args.seed, args.output).to_string(index=False))
+    if args.compare:
+        print(compare_benchmarks(args.compare, args.output).to_string())
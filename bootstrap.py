@@ -0,0 +1,308 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: bootstrap.py : python script with the resampling significance tests of the models           -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import functions
+
+# Largest number of elements of a resample-index matrix, replicates are computed in batches of this size
+batch_elements = 1 << 22
+# Sample and statistic of the running test, set once per worker process by _init_worker
+_shared = {}
+
+
+def _prices(midprices=None):
+    # float64 prices of a Series or of a DataFrame with a "Mid Price" column
+    if isinstance(midprices, pd.DataFrame):
+        midprices = midprices["Mid Price"]
+    return np.asarray(midprices, dtype=np.float64)
+
+
+def martingale_sample(midprices=None, freq: str = None):
+    """
+    Observations of the martingale ratio: 1 for every price equal to the previous one
+    (e1) and 0 for every change (e2), so their mean is the e1 ratio of Model1_E1. With
+    freq, the e1 ratio of every bucket of Model1_E2 instead, whose mean is E1 Ratio Mean.
+    Buckets with a single snapshot have no ratio (NaN) and are left out, as in the
+    nanmean of E1 Ratio Mean.
+    """
+    if freq is not None:
+        if isinstance(midprices, pd.DataFrame):
+            midprices = midprices["Mid Price"]
+        APT_dict_df, _ = functions.martingale_test(midprices, freq)
+        ratios = APT_dict_df["ratio1"].to_numpy(dtype=np.float64)
+        return ratios[~np.isnan(ratios)][None, :]
+    prices = _prices(midprices)
+    return (prices[1:] == prices[:-1]).astype(np.float64)[None, :]
+
+
+def roll_sample(midprices=None):
+    """
+    Observations of the Roll model: the (dP_t, dP_t_1) pairs of the price changes, as
+    the rows of a 2 x n array.
+    """
+    dP = np.diff(_prices(midprices))
+    return np.vstack([dP[1:], dP[:-1]])
+
+
+def ratio_statistic(sample: np.ndarray = None, idx: np.ndarray = None):
+    """Mean of the resampled observations, for every row of the index matrix."""
+    return sample[0][idx].mean(axis=1)
+
+
+def roll_cov_statistic(sample: np.ndarray = None, idx: np.ndarray = None):
+    """Covariance of the resampled (dP_t, dP_t_1) pairs, for every row of the index matrix."""
+    x, y = sample[0][idx], sample[1][idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ((x - x.mean(axis=1, keepdims=True))*(y - y.mean(axis=1, keepdims=True))).sum(axis=1)/(idx.shape[1] - 1)
+
+
+def roll_spread(cov=None):
+    """Roll spread 2*Sqrt(-cov) of covariances (NaN for a positive covariance, as in Model2)."""
+    cov = np.asarray(cov, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return 2*np.sqrt(np.where(cov <= 0, 0.0 - cov, np.nan))
+
+
+def roll_statistic(sample: np.ndarray = None, idx: np.ndarray = None):
+    """
+    Roll spread 2*Sqrt(-cov) of the resampled (dP_t, dP_t_1) pairs, for every row of the
+    index matrix (NaN for a positive covariance, as in Model2).
+    """
+    return roll_spread(roll_cov_statistic(sample, idx))
+
+
+def _block_size(n: int = None, block: int = None):
+    # n**(1/3) is the usual order of the block length of a block bootstrap
+    return max(1, min(n, int(round(n**(1/3))) if block is None else int(block)))
+
+
+def _init_worker(sample: np.ndarray = None, statistic=None):
+    # The sample is sent to every worker once, the batches only carry their size and seed
+    _shared["sample"], _shared["statistic"] = sample, statistic
+
+
+def _bootstrap_batches(batches: list = None, block: int = None):
+    # Replicates of some batches, each a (replicates x n) matrix of circular moving-block indices
+    sample, statistic = _shared["sample"], _shared["statistic"]
+    n = sample.shape[1]
+    values = []
+    for i_replicates, i_seed in batches:
+        rng = np.random.default_rng(i_seed)
+        starts = rng.integers(0, n, size=(i_replicates, -(-n//block)))
+        idx = ((starts[:, :, None] + np.arange(block)) % n).reshape(i_replicates, -1)[:, :n]
+        values.append(statistic(sample, idx))
+    return np.concatenate(values)
+
+
+def _permutation_batches(batches: list = None, block: int = None, n_a: int = None):
+    # Replicates of some batches: the blocks of both samples are shuffled and split again
+    sample, statistic = _shared["sample"], _shared["statistic"]
+    n_blocks = sample.shape[1]//block
+    values = []
+    for i_replicates, i_seed in batches:
+        rng = np.random.default_rng(i_seed)
+        order = np.argsort(rng.random((i_replicates, n_blocks)), axis=1)
+        idx = (order[:, :, None]*block + np.arange(block)).reshape(i_replicates, -1)
+        values.append(statistic(sample, idx[:, :n_a]) - statistic(sample, idx[:, n_a:]))
+    return np.concatenate(values)
+
+
+def _run_batches(worker=None, batches: list = None, sample: np.ndarray = None, statistic=None,
+                 max_workers: int = None):
+    """
+    Runs the batches in this process (a single worker or batch) or in a pool of processes
+    that receive the sample once, through the pool initializer. The batches are split in
+    one contiguous group per worker and the results are joined in batch order, so they do
+    not depend on the number of workers.
+    """
+    if max_workers == 1 or len(batches) == 1:
+        _init_worker(sample, statistic)
+        try:
+            return worker(batches)
+        finally:
+            _shared.clear()
+    workers = min(max_workers or os.cpu_count() or 1, len(batches))
+    groups = [[batches[i_pos] for i_pos in i_group] for i_group in np.array_split(np.arange(len(batches)), workers)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(sample, statistic)) as executor:
+        return np.concatenate(list(executor.map(worker, groups)))
+
+
+def _batches(replicates: int = None, n: int = None, seed=None):
+    # Replicates of every batch and an independent child seed for each one. The split only
+    # depends on replicates and n, so results are the same for any number of workers.
+    size = max(1, min(replicates, batch_elements//max(n, 1)))
+    sizes = [min(size, replicates - i_start) for i_start in range(0, replicates, size)]
+    return sizes, np.random.SeedSequence(seed).spawn(len(sizes))
+
+
+def block_bootstrap(sample: np.ndarray = None, statistic=ratio_statistic, replicates: int = 10000,
+                    block: int = None, alpha: float = 0.05, seed=None, max_workers: int = None):
+    """
+    Moving block bootstrap
+    Resamples the observations in circular blocks of consecutive values, which keeps
+    their serial dependence, and recomputes the statistic for every replicate. The
+    replicates are drawn as resample-index matrices and evaluated in batched NumPy, with
+    the batches split over a pool of processes (the sample is sent once per process),
+    each batch with its own seed spawned from seed (np.random.SeedSequence), so the
+    result is reproducible for any number of processes.
+
+    Parameters
+    ----------
+    sample (np.ndarray) : (k x n) observations, such as martingale_sample or roll_sample
+    statistic (function) : statistic(sample, idx), the statistic of every row of idx, such
+    as ratio_statistic or roll_statistic (a module level function, so it can be pickled)
+    replicates (int) : Number of bootstrap replicates
+    block (int) : Block length (n**(1/3) by default)
+    alpha (float) : 1 - confidence of the percentile interval
+    seed (int) : Seed of the replicates
+    max_workers (int) : Number of processes (all the cores by default, 1 to stay in process)
+
+    Returns
+    -------
+    summary (Series) : Estimate, mean, standard error and percentile interval of the replicates
+    (NaN bounds when the estimate is NaN)
+    values (np.ndarray) : Statistic of every replicate
+    """
+    sample = np.atleast_2d(np.asarray(sample, dtype=np.float64))
+    n = sample.shape[1]
+    block = _block_size(n, block)
+    sizes, seeds = _batches(replicates, n, seed)
+    values = _run_batches(partial(_bootstrap_batches, block=block), list(zip(sizes, seeds)), sample, statistic,
+                          max_workers)
+
+    estimate = statistic(sample, np.arange(n)[None, :])[0]
+    summary = pd.Series({
+        "Estimate" : estimate,
+        "Bootstrap Mean" : np.nanmean(values),
+        "Std Error" : np.nanstd(values, ddof=1),
+        "CI Low" : np.nan if np.isnan(estimate) else np.nanquantile(values, alpha/2),
+        "CI High" : np.nan if np.isnan(estimate) else np.nanquantile(values, 1 - alpha/2),
+        "Replicates" : replicates,
+        "Valid Replicates" : int(np.sum(~np.isnan(values))),
+        "Block" : block
+    })
+    return summary, values
+
+
+def permutation_test(sample_a: np.ndarray = None, sample_b: np.ndarray = None, statistic=ratio_statistic,
+                     replicates: int = 10000, block: int = None, seed=None, max_workers: int = None):
+    """
+    Block permutation test
+    Tests whether the statistic of two samples (two days, two venues) is the same. Both
+    samples are cut into blocks of consecutive observations and, in every replicate, the
+    blocks are shuffled between the samples; the difference of the statistic over the
+    shuffled samples gives its distribution under the null hypothesis. The last
+    observations of each sample that do not fill a block are left out. Replicates are
+    batched and split over processes as in block_bootstrap.
+
+    Parameters
+    ----------
+    sample_a, sample_b (np.ndarray) : (k x n) observations of both samples
+    statistic (function) : statistic(sample, idx), see block_bootstrap
+    replicates (int) : Number of permutations
+    block (int) : Block length (n**(1/3) of the smaller sample by default, 1 shuffles
+    single observations)
+    seed (int) : Seed of the permutations
+    max_workers (int) : Number of processes (all the cores by default, 1 to stay in process)
+
+    Returns
+    -------
+    summary (Series) : Statistic of each sample, observed difference and two sided p-value
+    values (np.ndarray) : Difference of every permutation
+    """
+    sample_a = np.atleast_2d(np.asarray(sample_a, dtype=np.float64))
+    sample_b = np.atleast_2d(np.asarray(sample_b, dtype=np.float64))
+    block = _block_size(min(sample_a.shape[1], sample_b.shape[1]), block)
+    n_a, n_b = sample_a.shape[1]//block*block, sample_b.shape[1]//block*block
+    sample = np.hstack([sample_a[:, :n_a], sample_b[:, :n_b]])
+    sizes, seeds = _batches(replicates, n_a + n_b, seed)
+    values = _run_batches(partial(_permutation_batches, block=block, n_a=n_a), list(zip(sizes, seeds)), sample,
+                          statistic, max_workers)
+
+    stat_a = statistic(sample, np.arange(n_a)[None, :])[0]
+    stat_b = statistic(sample, np.arange(n_a, n_a + n_b)[None, :])[0]
+    difference = stat_a - stat_b
+    valid = values[~np.isnan(values)]
+    summary = pd.Series({
+        "Statistic A" : stat_a,
+        "Statistic B" : stat_b,
+        "Difference" : difference,
+        "p-value" : (1 + np.sum(np.abs(valid) >= abs(difference)))/(1 + len(valid)) if not np.isnan(difference)
+        else np.nan,
+        "Replicates" : replicates,
+        "Valid Replicates" : len(valid),
+        "Block" : block
+    })
+    return summary, values
+
+
+def martingale_bootstrap(midprices=None, freq: str = None, **kwargs):
+    """
+    Bootstrap of the e1 ratio of Model1_E1 (or, with freq, of the E1 Ratio Mean of
+    Model1_E2), see block_bootstrap for the other arguments.
+    """
+    return block_bootstrap(martingale_sample(midprices, freq), ratio_statistic, **kwargs)
+
+
+def roll_bootstrap(midprices=None, **kwargs):
+    """
+    Bootstrap of the Calculated Spread of Model2, see block_bootstrap for the other arguments.
+    The spread is not defined for the replicates with a positive covariance, so the lag-1
+    covariance is bootstrapped instead and the bounds of its percentile interval are mapped
+    to the spread (a positive upper bound of the covariance gives a lower bound of 0, and
+    both bounds are NaN when the spread of the sample itself is). Positive Cov Share is the
+    share of replicates without a spread.
+
+    Returns
+    -------
+    summary (Series) : Spread, its percentile interval and the bootstrap of the covariance
+    values (np.ndarray) : Covariance of every replicate
+    """
+    cov_summary, values = block_bootstrap(roll_sample(midprices), roll_cov_statistic, **kwargs)
+    estimate = roll_spread(cov_summary["Estimate"])
+    # The spread decreases with the covariance: the upper bound of the covariance gives the lower one
+    ci_low, ci_high = roll_spread(np.minimum([cov_summary["CI High"], cov_summary["CI Low"]], 0))
+    summary = pd.Series({
+        "Estimate" : estimate,
+        "CI Low" : np.nan if np.isnan(estimate) else ci_low,
+        "CI High" : np.nan if np.isnan(estimate) else ci_high,
+        "Covariance" : cov_summary["Estimate"],
+        "Covariance Std Error" : cov_summary["Std Error"],
+        "Positive Cov Share" : np.mean(values[~np.isnan(values)] > 0),
+        "Replicates" : cov_summary["Replicates"],
+        "Valid Replicates" : cov_summary["Valid Replicates"],
+        "Block" : cov_summary["Block"]
+    })
+    return summary, values
+
+
+def martingale_permutation(midprices_a=None, midprices_b=None, freq: str = None, **kwargs):
+    """
+    Permutation test of the difference of the e1 ratios of two price series (or, with
+    freq, of their E1 Ratio Mean), see permutation_test for the other arguments.
+    """
+    return permutation_test(martingale_sample(midprices_a, freq), martingale_sample(midprices_b, freq),
+                            ratio_statistic, **kwargs)
+
+
+def roll_permutation(midprices_a=None, midprices_b=None, **kwargs):
+    """
+    Permutation test of the difference of the Roll spreads of two price series, see
+    permutation_test for the other arguments.
+    """
+    return permutation_test(roll_sample(midprices_a), roll_sample(midprices_b), roll_statistic, **kwargs)
@@ -0,0 +1,249 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: cache.py : python script with the results cache of the models                               -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data import OrderBooks, ob_columns
+
+# Bumped by hand when results change for reasons the source hashes cannot see (dependencies, data files)
+CACHE_VERSION = 1
+
+
+def fingerprint(obj=None):
+    """
+    Content fingerprint of a model input
+    OrderBooks opened from the binary cache use the SHA-256 of their source file, other
+    OrderBooks hash their arrays, pandas objects hash their values, index and columns, and
+    anything else its repr. Equal content always gives the same fingerprint.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(obj, OrderBooks):
+        source = getattr(obj, "source_fingerprint", None)
+        if source is not None:
+            digest.update(source.encode())
+        else:
+            for i_col in ["timestamps", "offsets"] + ob_columns:
+                digest.update(np.ascontiguousarray(getattr(obj, i_col)).data)
+            digest.update(str(obj.tz).encode())
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().data)
+        if isinstance(obj, pd.DataFrame):
+            digest.update(repr((list(obj.columns), list(map(str, obj.dtypes)))).encode())
+        else:
+            digest.update(repr((obj.name, str(obj.dtype))).encode())
+    elif isinstance(obj, np.ndarray):
+        digest.update(np.ascontiguousarray(obj).data)
+        digest.update(str(obj.dtype).encode())
+    else:
+        digest.update(repr(obj).encode())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _source_hash(obj=None):
+    # Hash of the source of a function or class (of its repr when there is no source)
+    try:
+        source = inspect.getsource(obj)
+    except (OSError, TypeError):
+        source = repr(obj)
+    return hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+
+
+def _module_version(module_name: str = None):
+    """
+    Hash of every function and class in the namespace of a module (its own and the ones
+    it imports, such as OrderBooks), so editing or patching any helper a model calls, like
+    APT_engine under Model1_E2 or roll_cov under Model2, invalidates the results too.
+    """
+    digest = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=8)
+    module = sys.modules.get(module_name)
+    for i_name, i_obj in sorted(vars(module).items() if module is not None else []):
+        if inspect.isfunction(i_obj) or inspect.isclass(i_obj):
+            digest.update("{}={};".format(i_name, _source_hash(i_obj)).encode())
+    return digest.hexdigest()
+
+
+def _function_id(func=None):
+    # Name of the function plus the hashes of its source and of its module
+    return "{}.{}:{}:{}".format(func.__module__, func.__qualname__, _source_hash(func),
+                                _module_version(func.__module__))
+
+
+class ResultCache:
+    """
+    Model results cache
+    Content-addressed cache of model outputs, keyed on the fingerprint of the inputs, the
+    function (name and source) and the parameters. Results are kept in an in-memory LRU
+    and on disk, one folder per result: DataFrames as Parquet (when pyarrow is installed,
+    pickle otherwise) and any other value pickled. When the disk layer grows above
+    max_bytes, the least recently used results are removed.
+
+    Parameters
+    ----------
+    directory (str) : Folder of the disk layer (None for a memory only cache)
+    max_bytes (int) : Largest size of the disk layer
+    memory_items (int) : Number of results kept in memory
+
+    """
+
+    def __init__(self, directory: str = "files/results.cache", max_bytes: int = 1 << 30, memory_items: int = 32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func=None, *args, **kwargs):
+        """Key of a call: hash of the function id, the fingerprint of the args and the kwargs."""
+        parts = [_function_id(func)] + [fingerprint(i_arg) for i_arg in args] + \
+                ["{}={}".format(i_name, fingerprint(kwargs[i_name])) for i_name in sorted(kwargs)]
+        return hashlib.blake2b("|".join(parts).encode(), digest_size=20).hexdigest()
+
+    def call(self, func=None, *args, **kwargs):
+        """Returns func(*args, **kwargs), from the cache when it was already computed."""
+        key = self.key(func, *args, **kwargs)
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = func(*args, **kwargs)
+        self.put(key, value)
+        return value
+
+    def cached(self, func=None):
+        """Decorator version of call."""
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        wrapper.__wrapped__ = func
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+
+    def get(self, key: str = None):
+        """
+        Returns
+        -------
+        found (bool) : Whether the key is in the cache
+        value : The cached result (None when not found)
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return True, self.memory[key]
+        if self.directory is None:
+            return False, None
+        folder = os.path.join(self.directory, key)
+        manifest_file = os.path.join(folder, "manifest.json")
+        if not os.path.exists(manifest_file):
+            return False, None
+        try:
+            with open(manifest_file) as file:
+                manifest = json.load(file)
+            parts = [self._read_part(folder, i_part) for i_part in manifest["parts"]]
+        except (OSError, ValueError, pickle.UnpicklingError):
+            shutil.rmtree(folder, ignore_errors=True)
+            return False, None
+        # Last access time, used by the eviction
+        os.utime(manifest_file)
+        value = tuple(parts) if manifest["kind"] == "tuple" else parts[0]
+        self._remember(key, value)
+        return True, value
+
+    def put(self, key: str = None, value=None):
+        """Stores a result in memory and on disk."""
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        folder = os.path.join(self.directory, key)
+        tmp_folder = folder + ".tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        values = value if isinstance(value, tuple) else (value,)
+        manifest = {"kind": "tuple" if isinstance(value, tuple) else "single",
+                    "parts": [self._write_part(tmp_folder, i_pos, i_value) for i_pos, i_value in enumerate(values)]}
+        with open(os.path.join(tmp_folder, "manifest.json"), "w") as file:
+            json.dump(manifest, file)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+        self.evict()
+
+    def _remember(self, key: str = None, value=None):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    @staticmethod
+    def _write_part(folder: str = None, i_pos: int = None, value=None):
+        if isinstance(value, pd.DataFrame):
+            filename = "{}.parquet".format(i_pos)
+            try:
+                value.to_parquet(os.path.join(folder, filename))
+                return {"type": "parquet", "file": filename}
+            except (ImportError, ValueError, TypeError, NotImplementedError):
+                # No pyarrow/fastparquet, or a frame Parquet cannot represent
+                pass
+        filename = "{}.pkl".format(i_pos)
+        with open(os.path.join(folder, filename), "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        return {"type": "pickle", "file": filename}
+
+    @staticmethod
+    def _read_part(folder: str = None, part: dict = None):
+        filename = os.path.join(folder, part["file"])
+        if part["type"] == "parquet":
+            return pd.read_parquet(filename)
+        with open(filename, "rb") as file:
+            return pickle.load(file)
+
+    def size(self):
+        """Bytes used by the disk layer, by key."""
+        sizes = {}
+        if self.directory is None or not os.path.isdir(self.directory):
+            return sizes
+        for i_key in os.listdir(self.directory):
+            folder = os.path.join(self.directory, i_key)
+            if os.path.isdir(folder) and not i_key.endswith(".tmp"):
+                sizes[i_key] = sum(os.path.getsize(os.path.join(folder, i_file)) for i_file in os.listdir(folder))
+        return sizes
+
+    def evict(self):
+        """Removes the least recently used results until the disk layer fits in max_bytes."""
+        sizes = self.size()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        last_used = {i_key: os.path.getmtime(os.path.join(self.directory, i_key, "manifest.json"))
+                     if os.path.exists(os.path.join(self.directory, i_key, "manifest.json")) else 0.0
+                     for i_key in sizes}
+        for i_key in sorted(sizes, key=last_used.get):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, i_key), ignore_errors=True)
+            self.memory.pop(i_key, None)
+            total -= sizes[i_key]
+
+    def clear(self):
+        """Empties both layers."""
+        self.memory.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
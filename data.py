@@ -9,22 +9,864 @@
 # -- --------------------------------------------------------------------------------------------------- -- #
 """
 
-import pandas as pd 
+import pandas as pd
+import numpy as np
 import json
+import os
+import re
+import hashlib
+import functools
+import shutil
+import tempfile
+from array import array
+from collections.abc import Mapping
+
+
+# Columns of every orderbook snapshot, in the order they are displayed
+ob_columns = ["bid_size", "bid", "ask", "ask_size"]
+# Number of timestamps parsed at once while building the columnar arrays
+ts_block = 65536
+# Tokens that open or close a JSON value, and the rest of a string after its opening quote
+_skip_token = re.compile(r'[{}\[\]"]')
+_string_end = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def _extend_timestamps(timestamps: array = None, keys: list = None):
+    """
+    Parses a block of timestamp strings in a single vectorized call and appends them,
+    as int64 nanoseconds, to the timestamps array. Returns the timezone of the block.
+    """
+    l_ts = pd.DatetimeIndex(pd.to_datetime(keys))
+    timestamps.extend(l_ts.values.astype("datetime64[ns]").view(np.int64))
+    return l_ts.tz
+
+
+def _timestamp_ns(key=None, tz=None):
+    """
+    int64 nanoseconds of a timestamp (string, Timestamp or datetime), read in the timezone
+    tz when it is naive and converted to naive UTC when tz is None.
+    """
+    key = pd.Timestamp(key)
+    if key.tz is None and tz is not None:
+        key = key.tz_localize(tz)
+    elif key.tz is not None and tz is None:
+        key = key.tz_convert("UTC").tz_localize(None)
+    return key.value
+
+
+class _JSONStream:
+    """
+    Minimal incremental JSON reader
+    Walks the nested objects of a file one token at a time, keeping in memory only a
+    buffer of a few chunks and the value being decoded, so the whole file is never
+    materialized as Python objects.
+
+    Parameters
+    ----------
+    file (file object) : Text file opened for reading
+    chunk_size (int) : Number of characters read from the file at a time
+
+    """
+
+    def __init__(self, file, chunk_size: int = 1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Drops the consumed part of the buffer and appends the next chunk of the file
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def peek(self):
+        """Next non-blank character, without consuming it ("" at the end of the file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str = None):
+        """Consumes the next non-blank character, which has to be char."""
+        if self.peek() != char:
+            raise ValueError("Malformed JSON, expected {!r} at {!r}".format(
+                char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete JSON value, reading more chunks while it is truncated."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer could continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self):
+        """
+        Iterates the (key, value) members of the next JSON object, where value is a
+        callable that decodes the member value. Members whose value was not requested
+        are skipped without being decoded.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            consumed = []
+
+            def decode():
+                consumed.append(True)
+                return self.value()
+
+            yield key, decode
+            if not consumed:
+                self.skip()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+    def skip(self):
+        """
+        Skips the next value without decoding it: the brackets and strings of objects and
+        lists are matched on the raw text, so their contents never become Python objects.
+        """
+        if self.peek() not in '{["':
+            # Numbers, true, false and null
+            self.value()
+            return
+        depth = 0
+        while True:
+            token = _skip_token.search(self.buffer, self.pos)
+            if token is None:
+                self.pos = len(self.buffer)
+            elif token.group() == '"':
+                string = _string_end.match(self.buffer, token.end())
+                if string is not None:
+                    self.pos = string.end()
+                    if depth == 0:
+                        return
+                    continue
+                # The string continues in the next chunk
+                self.pos = token.start()
+            else:
+                depth += 1 if token.group() in "{[" else -1
+                self.pos = token.end()
+                if depth == 0:
+                    return
+                continue
+            if not self._fill():
+                raise ValueError("Malformed JSON, truncated value at {!r}".format(
+                    self.buffer[self.pos:self.pos + 20]))
+
+
+class Snapshot:
+    """
+    Lightweight view of one OrderBook snapshot
+    Holds the timestamp (int64 nanoseconds) and the four level arrays of a snapshot as
+    views of the columnar store, in a __slots__ object with no per instance dictionary.
+    snapshot["bid"] works like on a JSON snapshot or a DataFrame, and to_frame() builds
+    the DataFrame when it is really needed.
+
+    """
+
+    __slots__ = ("timestamp", "bid_size", "bid", "ask", "ask_size")
+
+    def __init__(self, timestamp=None, bid_size=None, bid=None, ask=None, ask_size=None):
+        self.timestamp = timestamp
+        self.bid_size = bid_size
+        self.bid = bid
+        self.ask = ask
+        self.ask_size = ask_size
+
+    def __getitem__(self, column):
+        if column not in ob_columns:
+            raise KeyError(column)
+        return getattr(self, column)
+
+    def __len__(self):
+        return len(self.bid)
+
+    def to_frame(self):
+        """DataFrame of the snapshot, with the original column order."""
+        return pd.DataFrame({i_col: getattr(self, i_col) for i_col in ob_columns})
+
+    def __repr__(self):
+        return "Snapshot(timestamp={}, levels={})".format(self.timestamp, len(self))
+
+
+class OrderBooks(Mapping):
+    """
+    Columnar OrderBook store
+    Keeps every snapshot of an exchange in flat contiguous NumPy arrays instead of one
+    DataFrame per timestamp. Snapshot i owns the levels offsets[i]:offsets[i+1] of the
+    bid_size, bid, ask and ask_size arrays, and its time is stored as int64 nanoseconds.
+
+    It behaves like the old dictionary of DataFrames: iterating gives the timestamps and
+    indexing with a timestamp builds the DataFrame of that snapshot on demand.
+
+    Parameters
+    ----------
+    timestamps (np.ndarray) : int64 nanoseconds of each snapshot, sorted ascending
+    offsets (np.ndarray) : int64 level offsets, length = number of snapshots + 1
+    bid_size, bid, ask, ask_size (np.ndarray) : float64 level values of all snapshots
+    tz (str) : Timezone of the timestamps (None for naive timestamps)
+
+    """
+
+    def __init__(self, timestamps, offsets, bid_size, bid, ask, ask_size, tz=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.bid_size = np.asarray(bid_size, dtype=np.float64)
+        self.bid = np.asarray(bid, dtype=np.float64)
+        self.ask = np.asarray(ask, dtype=np.float64)
+        self.ask_size = np.asarray(ask_size, dtype=np.float64)
+        self.tz = tz
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds the columnar store from (timestamp, snapshot) pairs, where every snapshot is
+        a dictionary (or DataFrame) with the bid_size, bid, ask and ask_size levels.
+        None snapshots are skipped, a snapshot whose columns have different lengths raises
+        a ValueError (the four columns share the same offsets).
+
+        Parameters
+        ----------
+        items (iterable) : Iterable of (timestamp, snapshot) pairs
+
+        Returns
+        -------
+        OrderBooks : Columnar store with the snapshots sorted by timestamp
+        """
+        keys = []
+        timestamps = array("q")
+        tz = None
+        levels = array("q")
+        cols = {i_col: array("d") for i_col in ob_columns}
+        for i_key, i_ob in items:
+            if i_ob is None:
+                continue
+            n_levels = len(i_ob["bid"])
+            if any(len(i_ob[i_col]) != n_levels for i_col in ob_columns):
+                raise ValueError("The columns of the snapshot {} have different lengths ({})".format(
+                    i_key, ", ".join("{} {}".format(i_col, len(i_ob[i_col])) for i_col in ob_columns)))
+            keys.append(i_key)
+            levels.append(n_levels)
+            for i_col in ob_columns:
+                cols[i_col].extend(i_ob[i_col])
+            # Timestamps are parsed in blocks so only a few thousand strings are kept alive
+            if len(keys) == ts_block:
+                tz = _extend_timestamps(timestamps, keys)
+                keys = []
+        if keys or not timestamps:
+            tz = _extend_timestamps(timestamps, keys)
+
+        offsets = np.zeros(len(timestamps) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.frombuffer(levels, dtype=np.int64))
+        books = cls(np.frombuffer(timestamps, dtype=np.int64), offsets,
+                    *[np.frombuffer(cols[i_col], dtype=np.float64) for i_col in ob_columns], tz=tz)
+        if np.any(np.diff(books.timestamps) < 0):
+            books = books.take(np.argsort(books.timestamps, kind="stable"))
+        return books
+
+    @classmethod
+    def from_dict(cls, ob_dict: dict = None):
+        """
+        Builds the columnar store from a {timestamp: snapshot} dictionary, such as the
+        exchange entry of the orderbooks JSON file.
+        """
+        return cls.from_items(ob_dict.items())
+
+    def take(self, positions):
+        """
+        Returns a new store with the snapshots at the given positions, in that order.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        levels = np.diff(self.offsets)[positions]
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(levels)
+        # Position of every kept level inside the original arrays
+        rows = np.repeat(self.offsets[positions] - offsets[:-1], levels) + np.arange(offsets[-1])
+        return self._subset(self.timestamps[positions], offsets, rows)
+
+    def slice(self, start: int = None, end: int = None):
+        """
+        Returns the snapshots at positions start:end as a new store whose arrays are views
+        of this one (nothing is copied, or read from disk for a memory-mapped store).
+        """
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        first, last = self.offsets[start], self.offsets[end]
+        books = self._subset(self.timestamps[start:end], self.offsets[start:end + 1] - first, slice(first, last))
+        source = getattr(self, "source_fingerprint", None)
+        if source is not None:
+            # A window of a cached store is identified by its source and its rows
+            books.source_fingerprint = "{}[{}:{}]".format(source, start, end)
+        return books
+
+    def _column(self, column: str = None, rows=None):
+        # Values of a level column at the given rows (all of them for None, a slice gives a view)
+        values = getattr(self, column)
+        return values if rows is None else values[rows]
+
+    def _subset(self, timestamps=None, offsets=None, rows=None):
+        # New store with the given snapshots, whose levels are the given rows of this one
+        return OrderBooks(timestamps, offsets, *[self._column(i_col, rows) for i_col in ob_columns], tz=self.tz)
+
+    def _ns(self, key=None):
+        # int64 nanoseconds of a timestamp, read in the timezone of the store when it is naive
+        return _timestamp_ns(key, self.tz)
+
+    def between(self, start=None, end=None):
+        """
+        Snapshots with start <= timestamp < end (either bound can be None), as views of
+        this store found with a binary search over the timestamps.
+        """
+        i_start = 0 if start is None else int(np.searchsorted(self.timestamps, self._ns(start), side="left"))
+        i_end = len(self) if end is None else int(np.searchsorted(self.timestamps, self._ns(end), side="left"))
+        return self.slice(i_start, i_end)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the arrays of the store."""
+        return sum(getattr(self, i_col).nbytes for i_col in ["timestamps", "offsets"] + ob_columns)
+
+    def compact(self, max_decimals: int = 9):
+        """Compact copy of the store (integer ticks or float32), see CompactOrderBooks."""
+        return CompactOrderBooks.from_orderbooks(self, max_decimals)
+
+    def repeated(self):
+        """
+        Boolean mask of the snapshots identical to the previous one: same number of
+        levels and same bid_size, bid, ask and ask_size at every level (NaN equal to NaN).
+        """
+        levels = self.levels
+        same = np.zeros(len(self), dtype=bool)
+        if len(self) < 2:
+            return same
+        same[1:] = levels[1:] == levels[:-1]
+        # Levels of the candidates, compared with the same level of the previous snapshot
+        row_snapshot = np.repeat(np.arange(len(self)), levels)
+        rows = np.flatnonzero(same[row_snapshot])
+        previous = rows - levels[row_snapshot[rows]]
+        equal = np.ones(len(rows), dtype=bool)
+        for i_col in ob_columns:
+            values = self._column(i_col)
+            current, before = values[rows], values[previous]
+            equal &= (current == before) | (np.isnan(current) & np.isnan(before))
+        same[row_snapshot[rows[~equal]]] = False
+        return same
+
+    def deduplicate(self):
+        """Run-length encoded copy of the store, see DedupOrderBooks."""
+        return DedupOrderBooks.from_orderbooks(self)
+
+    @property
+    def levels(self):
+        """Number of price levels of every snapshot."""
+        return np.diff(self.offsets)
+
+    def padded(self, column: str = None, n_levels: int = None, fill: float = np.nan):
+        """
+        Level matrix of a column
+        Returns the (snapshots x n_levels) matrix of one of the level columns, where row i
+        holds the first n_levels of snapshot i and the missing levels are set to fill.
+
+        Parameters
+        ----------
+        column (str) : One of bid_size, bid, ask or ask_size
+        n_levels (int) : Number of levels kept (the deepest snapshot by default)
+        fill (float) : Value of the levels a snapshot does not have
+
+        Returns
+        -------
+        matrix (np.ndarray) : float64 (snapshots x n_levels) matrix
+        """
+        levels = self.levels
+        n_levels = int(levels.max()) if n_levels is None and len(levels) else (n_levels or 0)
+        matrix = np.full((len(self), n_levels), fill, dtype=np.float64)
+        rows = np.repeat(np.arange(len(self)), levels)
+        cols = np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], levels)
+        keep = cols < n_levels
+        matrix[rows[keep], cols[keep]] = getattr(self, column)[keep]
+        return matrix
+
+    def position(self, key):
+        """
+        Position of the snapshot with the given timestamp (string, Timestamp or datetime).
+        """
+        value = self._ns(key)
+        i_pos = np.searchsorted(self.timestamps, value)
+        if i_pos == len(self.timestamps) or self.timestamps[i_pos] != value:
+            raise KeyError(key)
+        return i_pos
+
+    def snapshot(self, i_pos):
+        """
+        DataFrame of the snapshot at position i_pos, with the original column order.
+        """
+        return self.view(i_pos).to_frame()
+
+    def view(self, i_pos):
+        """
+        Snapshot view of the snapshot at position i_pos, without building a DataFrame.
+        """
+        rows = slice(self.offsets[i_pos], self.offsets[i_pos + 1])
+        return Snapshot(self.timestamps[i_pos], *[self._column(i_col, rows) for i_col in ob_columns])
+
+    def views(self):
+        """Iterates the Snapshot views of all the snapshots, in timestamp order."""
+        for i_pos in range(len(self)):
+            yield self.view(i_pos)
+
+    @functools.cached_property
+    def index(self):
+        """
+        DatetimeIndex of the snapshots, built once from the int64 nanoseconds and shared by
+        every model that needs the timestamps.
+        """
+        l_ts = pd.DatetimeIndex(self.timestamps.astype("datetime64[ns]"))
+        return l_ts.tz_localize("UTC").tz_convert(self.tz) if self.tz is not None else l_ts
+
+    def keys(self):
+        return self.index
+
+    def __getitem__(self, key):
+        return self.snapshot(self.position(key))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return "OrderBooks(snapshots={}, levels={})".format(len(self), self.offsets[-1])
+
+
+def _encode(values: np.ndarray = None, max_decimals: int = 9):
+    """
+    Lossless compact encoding of a float64 column
+    Looks for the smallest number of decimals d such that every value is exactly
+    ticks/10**d, with integer ticks, and returns the ticks as int32 (int64 when they do
+    not fit), NaN stored as the smallest integer of the type. If no d up to max_decimals
+    round-trips exactly, float32 is used when it is exact and float64 otherwise.
+
+    Returns
+    -------
+    codes (np.ndarray) : Encoded values
+    decimals (int) : d of the integer ticks (None for float codes)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    finite = values[~missing]
+    for i_decimals in range(max_decimals + 1):
+        scale = 10.0**i_decimals
+        ticks = np.round(finite*scale)
+        largest = np.abs(ticks).max(initial=0)
+        # Integer ticks above 2**53 are no longer exact as floats
+        if largest >= 2**53:
+            break
+        if np.array_equal(ticks/scale, finite):
+            dtype = np.int32 if largest < np.iinfo(np.int32).max else np.int64
+            codes = np.full(len(values), np.iinfo(dtype).min, dtype=dtype)
+            codes[~missing] = ticks
+            return codes, i_decimals
+    codes = values.astype(np.float32)
+    if np.array_equal(codes.astype(np.float64), values, equal_nan=True):
+        return codes, None
+    return values, None
+
+
+def _decode(codes: np.ndarray = None, decimals: int = None):
+    """float64 values of codes encoded by _encode."""
+    if decimals is None:
+        return codes.astype(np.float64)
+    values = codes/10.0**decimals
+    values[codes == np.iinfo(codes.dtype).min] = np.nan
+    return values
+
+
+class CompactOrderBooks(OrderBooks):
+    """
+    Compact columnar OrderBook store
+    Same store as OrderBooks with every level column encoded by _encode: integer ticks
+    (prices and sizes as fixed-point int32/int64) or float32, whichever is exact. Values
+    are decoded to float64 only when a column or a snapshot is used, and the decoded
+    values are bit for bit the original ones, so every metric (and its np.round(..., 6))
+    is unchanged while the levels take half the memory or less.
+
+    Parameters
+    ----------
+    timestamps (np.ndarray) : int64 nanoseconds of each snapshot, sorted ascending
+    offsets (np.ndarray) : int64 level offsets, length = number of snapshots + 1
+    codes (dict) : Encoded values of every level column
+    decimals (dict) : Decimals of the integer ticks of every column (None for floats)
+    tz (str) : Timezone of the timestamps (None for naive timestamps)
+
+    """
+
+    def __init__(self, timestamps, offsets, codes: dict = None, decimals: dict = None, tz=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.codes = codes
+        self.decimals = decimals
+        self.tz = tz
+
+    @classmethod
+    def from_orderbooks(cls, books: OrderBooks = None, max_decimals: int = 9):
+        """Encodes every level column of a store, checking the exact round-trip."""
+        codes, decimals = {}, {}
+        for i_col in ob_columns:
+            codes[i_col], decimals[i_col] = _encode(getattr(books, i_col), max_decimals)
+        compact = cls(books.timestamps, books.offsets, codes, decimals, tz=books.tz)
+        source = getattr(books, "source_fingerprint", None)
+        if source is not None:
+            compact.source_fingerprint = source
+        return compact
+
+    bid_size = property(lambda self: self._column("bid_size"))
+    bid = property(lambda self: self._column("bid"))
+    ask = property(lambda self: self._column("ask"))
+    ask_size = property(lambda self: self._column("ask_size"))
+
+    def _column(self, column: str = None, rows=None):
+        # Only the requested rows are decoded
+        codes = self.codes[column]
+        return _decode(codes if rows is None else codes[rows], self.decimals[column])
+
+    def _subset(self, timestamps=None, offsets=None, rows=None):
+        return CompactOrderBooks(timestamps, offsets, {i_col: self.codes[i_col][rows] for i_col in ob_columns},
+                                 self.decimals, tz=self.tz)
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.offsets.nbytes + sum(i_codes.nbytes for i_codes in self.codes.values())
+
+    def compact(self, max_decimals: int = 9):
+        return self
+
+    def expand(self):
+        """Plain float64 OrderBooks with the decoded values."""
+        return OrderBooks(self.timestamps, self.offsets, *[self._column(i_col) for i_col in ob_columns], tz=self.tz)
+
+    def __repr__(self):
+        return "CompactOrderBooks(snapshots={}, levels={}, nbytes={})".format(len(self), self.offsets[-1], self.nbytes)
+
+
+class DedupOrderBooks(OrderBooks):
+    """
+    Run-length encoded OrderBook store
+    Keeps every distinct book once: runs of identical consecutive snapshots (a quiet
+    market, the e1 cases of the martingale tests) are stored as their timestamps plus
+    book_index, the position of every snapshot's book inside books. Level columns are
+    expanded only when they are used; df_metrics computes the metrics once per distinct
+    book and broadcasts them, and view, padded and slice work on the distinct books.
+
+    Parameters
+    ----------
+    timestamps (np.ndarray) : int64 nanoseconds of every snapshot, sorted ascending
+    book_index (np.ndarray) : int64 position in books of the book of every snapshot
+    books (OrderBooks) : Distinct books (timestamp of the first snapshot of each run)
+    tz (str) : Timezone of the timestamps (None for naive timestamps)
+
+    """
+
+    def __init__(self, timestamps, book_index, books: OrderBooks = None, tz=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.book_index = np.asarray(book_index, dtype=np.int64)
+        self.books = books
+        self.tz = tz
+
+    @classmethod
+    def from_orderbooks(cls, books: OrderBooks = None):
+        """Finds the runs of identical snapshots of a store and keeps one book per run."""
+        new_book = ~books.repeated()
+        book_index = np.cumsum(new_book) - 1
+        dedup = cls(books.timestamps, book_index, books.take(np.flatnonzero(new_book)), tz=books.tz)
+        source = getattr(books, "source_fingerprint", None)
+        if source is not None:
+            dedup.source_fingerprint = source
+        return dedup
+
+    @property
+    def offsets(self):
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(self.books.levels[self.book_index])
+        return offsets
+
+    bid_size = property(lambda self: self._column("bid_size"))
+    bid = property(lambda self: self._column("bid"))
+    ask = property(lambda self: self._column("ask"))
+    ask_size = property(lambda self: self._column("ask_size"))
+
+    def _column(self, column: str = None, rows=None):
+        # Row of books of every expanded level row, then only the requested ones are read
+        levels = self.books.levels[self.book_index]
+        offsets = np.concatenate([[0], np.cumsum(levels)])
+        book_rows = np.repeat(self.books.offsets[self.book_index] - offsets[:-1], levels) + np.arange(offsets[-1])
+        return self.books._column(column, book_rows if rows is None else book_rows[rows])
+
+    def slice(self, start: int = None, end: int = None):
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        if start == end:
+            return DedupOrderBooks(self.timestamps[:0], self.book_index[:0], self.books.slice(0, 0), tz=self.tz)
+        first, last = self.book_index[start], self.book_index[end - 1] + 1
+        dedup = DedupOrderBooks(self.timestamps[start:end], self.book_index[start:end] - first,
+                                self.books.slice(first, last), tz=self.tz)
+        source = getattr(self, "source_fingerprint", None)
+        if source is not None:
+            dedup.source_fingerprint = "{}[{}:{}]".format(source, start, end)
+        return dedup
+
+    def padded(self, column: str = None, n_levels: int = None, fill: float = np.nan):
+        if n_levels is None:
+            n_levels = int(self.books.levels.max()) if len(self.books) else 0
+        return self.books.padded(column, n_levels, fill)[self.book_index]
+
+    def view(self, i_pos):
+        book = self.books.view(self.book_index[i_pos])
+        book.timestamp = self.timestamps[i_pos]
+        return book
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.book_index.nbytes + self.books.nbytes
+
+    def compact(self, max_decimals: int = 9):
+        return DedupOrderBooks(self.timestamps, self.book_index, self.books.compact(max_decimals), tz=self.tz)
+
+    def deduplicate(self):
+        return self
+
+    def expand(self):
+        """Plain OrderBooks with one entry per snapshot."""
+        books = self.books.take(self.book_index)
+        return OrderBooks(self.timestamps, books.offsets, *[getattr(books, i_col) for i_col in ob_columns],
+                          tz=self.tz)
+
+    def __repr__(self):
+        return "DedupOrderBooks(snapshots={}, books={}, levels={})".format(len(self), len(self.books),
+                                                                           self.books.offsets[-1])
+
+
+def read_orderbooks(filename: str = None, exchange: str = "bitfinex", chunk_size: int = 1 << 20,
+                    start=None, end=None):
+    """
+    Streaming OrderBook reader
+    Parses the orderbooks JSON file in chunks, only decoding the snapshots of the selected
+    exchange one at a time and feeding them straight into the columnar arrays. The other
+    exchanges are skipped snapshot by snapshot, so peak memory is bounded by the chunk
+    size and the resulting arrays, not by the size of the file. With start and/or end,
+    only the snapshots with start <= timestamp < end are decoded.
+
+    Parameters
+    ----------
+    filename (str) : Location of the orderbooks JSON file
+    exchange (str) : Top level key of the exchange to load
+    chunk_size (int) : Number of characters read from the file at a time
+    start, end : Time range of the snapshots (None for an open bound)
+
+    Returns
+    -------
+    OrderBooks : Columnar store with the (not None) snapshots of the exchange
+    """
+    with open(filename) as file:
+        stream = _JSONStream(file, chunk_size)
+        for i_exchange, i_value in stream.members():
+            if i_exchange == exchange:
+                members = stream.members()
+                if start is not None or end is not None:
+                    members = _between_members(members, start, end)
+                return OrderBooks.from_items((i_ts, i_ob()) for i_ts, i_ob in members)
+    raise KeyError(exchange)
+
+
+def _between_members(members=None, start=None, end=None):
+    # Keeps the (timestamp, value) members inside the time range, the others are skipped
+    # by _JSONStream.members without being decoded
+    bounds = {}
+    for i_ts, i_ob in members:
+        ts = pd.Timestamp(i_ts)
+        if not bounds:
+            bounds["start"] = -np.inf if start is None else _timestamp_ns(start, ts.tz)
+            bounds["end"] = np.inf if end is None else _timestamp_ns(end, ts.tz)
+        if bounds["start"] <= ts.value < bounds["end"]:
+            yield i_ts, i_ob
+
+
+def _file_hash(filename: str = None, block_size: int = 1 << 20):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(filename: str = None, exchange: str = "bitfinex"):
+    """
+    Folder of the binary cache of an exchange, next to its source file
+    (files/orderbooks_05jul21.json -> files/orderbooks_05jul21.bitfinex.cache).
+    """
+    return os.path.splitext(filename)[0] + "." + exchange + ".cache"
+
+
+def _write_json(filename: str = None, obj: dict = None):
+    # Written to a temporary file that replaces filename, so readers never see half of it
+    staging = filename + ".tmp"
+    with open(staging, "w") as file:
+        json.dump(obj, file)
+    os.replace(staging, filename)
+
+
+def write_cache(books: OrderBooks = None, directory: str = None, meta: dict = None):
+    """
+    Writes the columnar arrays as one .npy file per column plus a meta.json with the
+    fingerprint of the source file. Everything is written to a new folder next to the
+    cache, which then takes the place of the old one with a rename: the files of an old
+    cache are never rewritten, as other stores may still have them memory-mapped (they
+    keep reading the old files until they are released).
+    """
+    parent, name = os.path.split(os.path.abspath(directory))
+    staging = tempfile.mkdtemp(prefix=name + ".new-", suffix=".cache", dir=parent)
+    try:
+        for i_col in ["timestamps", "offsets"] + ob_columns:
+            np.save(os.path.join(staging, i_col + ".npy"), getattr(books, i_col))
+        meta = dict(meta, tz=None if books.tz is None else str(books.tz), snapshots=len(books))
+        _write_json(os.path.join(staging, "meta.json"), meta)
+        retired = None
+        if os.path.exists(directory):
+            # Moved inside a folder of its own, as a folder can only be renamed over an empty one
+            retired = tempfile.mkdtemp(prefix=name + ".old-", suffix=".cache", dir=parent)
+            os.replace(directory, os.path.join(retired, name))
+        os.replace(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if retired is not None:
+        # Mapped files are only released by the system once nobody maps them
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+def open_cache(directory: str = None, start=None, end=None):
+    """
+    Opens a binary cache memory-mapped (read only), so no array is read until it is used.
+    timestamps.npy and offsets.npy are the snapshot index of the cache: with start and/or
+    end, the rows of the time range are found with a binary search over the timestamps
+    (a few pages of the file) and only the level rows of those snapshots are ever read.
+    """
+    with open(os.path.join(directory, "meta.json")) as file:
+        meta = json.load(file)
+    arrays = [np.load(os.path.join(directory, i_col + ".npy"), mmap_mode="r")
+              for i_col in ["timestamps", "offsets"] + ob_columns]
+    books = OrderBooks(*arrays, tz=meta["tz"])
+    # Content identity of the snapshots, used by the results cache
+    books.source_fingerprint = "{}:{}".format(meta.get("sha256"), meta.get("exchange"))
+    if start is not None or end is not None:
+        return books.between(start, end)
+    return books
+
+
+def cached_orderbooks(filename: str = None, exchange: str = "bitfinex", start=None, end=None):
+    """
+    Cached OrderBook loader
+    Returns the snapshots of an exchange from the binary cache next to the source file,
+    building it with read_orderbooks the first time. The cache is reused while the
+    modification time and size of the source are unchanged; if they changed, the SHA-256
+    of the source decides whether it has to be rebuilt.
+
+    Parameters
+    ----------
+    filename (str) : Location of the orderbooks JSON file
+    exchange (str) : Top level key of the exchange to load
+    start, end : Time range of the snapshots (None for an open bound)
+
+    Returns
+    -------
+    OrderBooks : Memory-mapped columnar store of the exchange (of the time range)
+    """
+    directory = cache_path(filename, exchange)
+    meta_file = os.path.join(directory, "meta.json")
+    stat = os.stat(filename)
+    source = {"exchange": exchange, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+    if os.path.exists(meta_file):
+        with open(meta_file) as file:
+            meta = json.load(file)
+        if all(meta.get(i_key) == i_value for i_key, i_value in source.items()):
+            return open_cache(directory, start, end)
+        source["sha256"] = _file_hash(filename)
+        if meta.get("sha256") == source["sha256"]:
+            # Same content with a new modification time (copied or touched file)
+            _write_json(meta_file, dict(meta, **source))
+            return open_cache(directory, start, end)
+
+    source.setdefault("sha256", _file_hash(filename))
+    write_cache(read_orderbooks(filename, exchange), directory, source)
+    return open_cache(directory, start, end)
 
 
 # File location inside files folder.
 filename = "files/orderbooks_05jul21.json"
-# Opening JSON file
-orderbooks_data = json.load(open(filename))
-# Selecting bitfinex data
-ob_data = orderbooks_data["bitfinex"]
-# Drop None Keys
-ob_data = {i_key: i_value for i_key, i_value in ob_data.items() if i_value is not None}
-# Convert to dataframe and rearange columns
-ob_data = {i_ob: pd.DataFrame(ob_data[i_ob])[["bid_size","bid","ask","ask_size"]]
-        if ob_data[i_ob] is not None else None for i_ob in list(ob_data.keys())}
 
 
+def load_orderbooks(path: str = filename, exchange: str = "bitfinex", start=None, end=None, compact: bool = False,
+                    dedup: bool = False):
+    """
+    Lazy OrderBook loader
+    Nothing is read when this module is imported, the orderbooks are loaded (from the
+    binary cache when possible) the first time they are requested, and the result is
+    memoized per file and exchange for the rest of the process. With start and/or end
+    only the snapshots of that time range are returned, as views of the memory-mapped
+    cache, so a short window costs in proportion to the window and not to the file.
+
+    Parameters
+    ----------
+    path (str) : Location of the orderbooks JSON file
+    exchange (str) : Top level key of the exchange to load
+    start, end : Time range of the snapshots, start <= timestamp < end (None for an
+    open bound, naive times are read in the timezone of the file)
+    compact (bool) : Return the snapshots in memory as a CompactOrderBooks
+    dedup (bool) : Store runs of identical consecutive snapshots once (DedupOrderBooks)
+
+    Returns
+    -------
+    OrderBooks : Columnar store of the exchange (of the time range)
+    """
+    books = _load_orderbooks(os.path.abspath(path), exchange)
+    if start is not None or end is not None:
+        books = books.between(start, end)
+    if dedup:
+        books = books.deduplicate()
+    return books.compact() if compact else books
+
+
+@functools.lru_cache(maxsize=None)
+def _load_orderbooks(path: str = None, exchange: str = None):
+    return cached_orderbooks(path, exchange)
 
 
+def __getattr__(name):
+    # Keeps dt.ob_data working, loading the default file on first access
+    if name == "ob_data":
+        return load_orderbooks()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
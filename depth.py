@@ -0,0 +1,122 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: depth.py : python script with full depth orderbook features                                 -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def sweep_price(prices: np.ndarray = None, sizes: np.ndarray = None, quantity: float = None):
+    """
+    Average price paid to take quantity units from one side of the book, walking the
+    levels in order. Rows whose levels do not hold quantity units are NaN.
+
+    Parameters
+    ----------
+    prices (np.ndarray) : (snapshots x levels) prices of one side, best level first
+    sizes (np.ndarray) : (snapshots x levels) sizes of the same side, 0 for missing levels
+    quantity (float) : Units to sweep
+
+    Returns
+    -------
+    avg_price (np.ndarray) : Average execution price of every snapshot
+    """
+    cum_size = np.cumsum(sizes, axis=1)
+    # Units taken from every level: what is left of quantity after the previous levels
+    filled = np.clip(quantity - (cum_size - sizes), 0, sizes)
+    cost = np.nansum(filled*prices, axis=1)
+    avg_price = cost/quantity
+    avg_price[cum_size[:, -1] < quantity] = np.nan
+    return avg_price
+
+
+def book_slope(distance: np.ndarray = None, cum_size: np.ndarray = None, valid: np.ndarray = None):
+    """
+    Least squares slope of the cumulative size vs the distance from the mid price, for
+    every row at once (units of size added per unit of price away from the mid).
+    """
+    n = valid.sum(axis=1)
+    x = np.where(valid, distance, 0.0)
+    y = np.where(valid, cum_size, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = x.sum(axis=1)/n
+        y_mean = y.sum(axis=1)/n
+        dx = np.where(valid, distance - x_mean[:, None], 0.0)
+        dy = np.where(valid, cum_size - y_mean[:, None], 0.0)
+        return (dx*dy).sum(axis=1)/(dx*dx).sum(axis=1)
+
+
+def depth_features(orderbooks=None, n_levels: int = 10, depth_levels: tuple = (1, 5, 10),
+                   sweep_sizes: tuple = (1.0, 5.0), chunk_size: int = 250_000):
+    """
+    Full depth OrderBook features
+    Computes, for every snapshot and in batch, features that use all the levels of the
+    book and not only the top. Each side is turned into a padded (snapshots x n_levels)
+    matrix and every feature is a level-wise vectorized reduction of those matrices. The
+    snapshots are processed in chunks to bound the size of the matrices.
+
+    The features returned are:
+    -1. Depth Weighted Mid: VWAP of each side weighted by the depth of the opposite side
+    -2. Bid/Ask Depth k: Cumulative size of the first k levels of each side
+    -3. Imbalance k: Bid Depth k / (Bid Depth k + Ask Depth k)
+    -4. Buy/Sell Impact X: Distance from the mid price of the average price of sweeping
+    X units from the asks (buy) or the bids (sell), NaN if the levels are not enough
+    -5. Bid/Ask Slope: Slope of the cumulative size vs the distance from the mid price
+
+    Parameters
+    ----------
+    orderbooks (OrderBooks) : Columnar OrderBook, such as data.load_orderbooks()
+    n_levels (int) : Levels of each side used for the features
+    depth_levels (tuple) : Values of k for the cumulative depth and imbalance (at most n_levels)
+    sweep_sizes (tuple) : Values of X for the price impact
+    chunk_size (int) : Snapshots processed at a time
+
+    Returns
+    -------
+    depth_df (DataFrame) : Features of every snapshot, indexed by timestamp
+    """
+    if max(depth_levels, default=0) > n_levels:
+        raise ValueError("depth_levels {} go beyond the {} levels used (n_levels)".format(depth_levels, n_levels))
+    frames = []
+    for i_start in range(0, len(orderbooks), chunk_size):
+        books = orderbooks.take(np.arange(i_start, min(i_start + chunk_size, len(orderbooks))))
+        bid, ask = books.padded("bid", n_levels), books.padded("ask", n_levels)
+        bid_size, ask_size = books.padded("bid_size", n_levels, 0.0), books.padded("ask_size", n_levels, 0.0)
+        mid = (bid[:, 0] + ask[:, 0])*0.5
+        features = {}
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Depth weighted mid
+            bid_depth, ask_depth = bid_size.sum(axis=1), ask_size.sum(axis=1)
+            bid_vwap = np.nansum(bid*bid_size, axis=1)/bid_depth
+            ask_vwap = np.nansum(ask*ask_size, axis=1)/ask_depth
+            features["Depth Weighted Mid"] = (bid_vwap*ask_depth + ask_vwap*bid_depth)/(bid_depth + ask_depth)
+
+            # Cumulative depth and imbalance at k levels
+            bid_cum, ask_cum = np.cumsum(bid_size, axis=1), np.cumsum(ask_size, axis=1)
+            for k in depth_levels:
+                k_col = k - 1
+                features["Bid Depth {}".format(k)] = bid_cum[:, k_col]
+                features["Ask Depth {}".format(k)] = ask_cum[:, k_col]
+                features["Imbalance {}".format(k)] = bid_cum[:, k_col]/(bid_cum[:, k_col] + ask_cum[:, k_col])
+
+            # Cost of sweeping X units, as distance from the mid price
+            for x in sweep_sizes:
+                features["Buy Impact {:g}".format(x)] = sweep_price(ask, ask_size, x) - mid
+                features["Sell Impact {:g}".format(x)] = mid - sweep_price(bid, bid_size, x)
+
+        # Book slope of each side
+        features["Bid Slope"] = book_slope(mid[:, None] - bid, bid_cum, ~np.isnan(bid))
+        features["Ask Slope"] = book_slope(ask - mid[:, None], ask_cum, ~np.isnan(ask))
+        frames.append(pd.DataFrame(features, index=books.keys()))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames)
@@ -8,8 +8,31 @@
 # -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
 # -- --------------------------------------------------------------------------------------------------- -- #
 """
+import warnings
 import numpy as np
 import pandas as pd
+from data import OrderBooks, DedupOrderBooks
+
+
+def _level_sums(values: np.ndarray = None, offsets: np.ndarray = None):
+    """
+    Sum of the levels of every snapshot, added like pandas Series.sum() on the snapshot
+    DataFrame (NaN as 0, NumPy pairwise summation), so the rounded volumes are the same as
+    summing snapshot by snapshot. Snapshots with the same number of levels are summed at
+    once as the rows of one (snapshots x levels) matrix.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = np.where(np.isnan(values), 0.0, values)
+    levels = np.diff(offsets)
+    sums = np.zeros(len(levels), dtype=np.float64)
+    order = np.argsort(levels, kind="stable")
+    bounds = np.flatnonzero(np.diff(levels[order])) + 1
+    for i_group in np.split(order, bounds):
+        if len(i_group) == 0 or levels[i_group[0]] == 0:
+            continue
+        rows = offsets[i_group][:, None] + np.arange(levels[i_group[0]])
+        sums[i_group] = values[rows].sum(axis=1)
+    return sums
 
 
 def df_metrics(data_ob: dict = None):
@@ -33,9 +56,14 @@ def df_metrics(data_ob: dict = None):
     Price Levels) are returned within a DataFrame, with the value of each metric corresponding to 
     its timestamp.
     
+    All the df_metrics are computed at once over the columnar arrays of the OrderBook,
+    level sums are obtained with _level_sums over the snapshot level offsets. For a
+    DedupOrderBooks they are computed once per distinct book and broadcast to the
+    repeated snapshots.
+
     Parameters
     ----------
-    data_ob (dict) : Dictonary containing the OrderBook
+    data_ob (OrderBooks or dict) : Columnar OrderBook or dictonary containing the OrderBook
 
     Returns
     -------
@@ -46,34 +74,47 @@ def df_metrics(data_ob: dict = None):
 
 
     """
-    ob_ts = list(data_ob.keys())
-    l_ts = [pd.to_datetime(i_ts) for i_ts in ob_ts]
+    if not isinstance(data_ob, OrderBooks):
+        # Dictionary of snapshot DataFrames, convert it once to the columnar store
+        data_ob = OrderBooks.from_dict(data_ob)
+    if isinstance(data_ob, DedupOrderBooks):
+        books_df, _, books_m4 = df_metrics(data_ob.books)
+        df_metrics_df = books_df.iloc[data_ob.book_index]
+        df_metrics_df.index = data_ob.index
+        m1 = np.median(np.diff(data_ob.timestamps))/1e6 if len(data_ob) > 1 else np.nan
+        return df_metrics_df, m1, np.asarray(books_m4, dtype=np.int64)[data_ob.book_index].tolist()
+    l_ts = data_ob.index
+    starts = data_ob.offsets[:-1]
+    # Top of the book of every snapshot
+    Bids_ToB = data_ob.bid[starts]
+    Asks_ToB = data_ob.ask[starts]
     # Median timedelta
-    m1 = np.median([l_ts[n_ts+1]-l_ts[n_ts] for n_ts in range(len(l_ts)-1)]).total_seconds()*1000
+    m1 = np.median(np.diff(data_ob.timestamps))/1e6 if len(data_ob) > 1 else np.nan
     # Spread
-    m2 = [data_ob[ob_ts[i]]["ask"][0]- data_ob[ob_ts[i]]["bid"][0] for i in range(len(ob_ts))]
+    m2 = Asks_ToB - Bids_ToB
     # MidPrice
-    m3 = [(data_ob[ob_ts[i]]["ask"][0]+ data_ob[ob_ts[i]]["bid"][0])*0.5 for i in range(len(ob_ts))]  
+    m3 = (Asks_ToB + Bids_ToB)*0.5
     # Price Levels
-    m4 = [data_ob[i_ts].shape[0] for i_ts in ob_ts]   
+    m4 = data_ob.levels.tolist()
+    # Sum of every snapshot level block, rounded once for every volume
+    bid_sum = _level_sums(data_ob.bid_size, data_ob.offsets)
+    ask_sum = _level_sums(data_ob.ask_size, data_ob.offsets)
     # Bid Volume
-    m5 = [np.round(data_ob[i_ts]["bid_size"].sum(), 6) for i_ts in ob_ts]  
+    m5 = np.round(bid_sum, 6)
     # Ask Volume
-    m6 = [np.round(data_ob[i_ts]["ask_size"].sum(), 6) for i_ts in ob_ts] 
+    m6 = np.round(ask_sum, 6)
     # Total Volume
-    m7 = [np.round(data_ob[i_ts]['bid_size'].sum() + data_ob[i_ts]['ask_size'].sum() , 6) for i_ts in ob_ts]  
+    m7 = np.round(bid_sum + ask_sum, 6)
     # Orderbook Imbalance
-    m8 = [m5[i_ts]/m7[i_ts] for i_ts in range(len(ob_ts))]
+    m8 = m5/m7
     #  Weighted-Midprice (Ask): ((Bid_Volume/ Bid_Volume + Ask Volume )) * ((bid_price[0] + ask_price[0])/2)
-    m9 = [m8[i_ts]*m3[i_ts] for i_ts in range(len(ob_ts))]
+    m9 = m8*m3
     # Weighted-MidPrice (Bid): ((Ask_Volume/ Bid_Volume + Ask Volume )*Bid_Price) + ((Bid_Volume/ Bid_Volume + Ask Volume )*Ask_Price)
-    m10 = [ (m6[i_ts]/(m5[i_ts] + m6[i_ts]) * data_ob[ob_ts[i_ts]]['bid'][0]) + (m8[i_ts]*(data_ob[ob_ts[i_ts]]['ask'][0])) for i_ts in range(len(ob_ts)) ]
-    Bids_ToB = [data_ob[ob_ts[i]]['bid'][0] for i in range(len(ob_ts))]
-    Asks_ToB = [data_ob[ob_ts[i]]['ask'][0] for i in range(len(ob_ts))]
+    m10 = (m6/(m5 + m6)*Bids_ToB) + (m8*Asks_ToB)
     # VWAP (Volume-Weighted-Average Price)
-    m11 = [np.round((Bids_ToB[i]*m5[i] + Asks_ToB[i]*m6[i]) / (m5[i]+m6[i]),6) for i in range(len(ob_ts))]
+    m11 = np.round((Bids_ToB*m5 + Asks_ToB*m6) / (m5 + m6), 6)
 
-    df_metrics = pd.DataFrame({
+    df_metrics_df = pd.DataFrame({
         "Spread" : m2,
         "Mid Price" : m3,
         "Bid Volume" : m5,
@@ -85,8 +126,117 @@ def df_metrics(data_ob: dict = None):
         "Volume Weighted Average Price" : m11
         
     })
-    df_metrics.index = l_ts
-    return df_metrics, m1, m4# Returns df_metrics dataframe, median of trades and no. of priceLevels
+    df_metrics_df.index = l_ts
+    return df_metrics_df, m1, m4# Returns df_metrics dataframe, median of trades and no. of priceLevels
+
+
+def interarrival_stats(data_ob=None, quantiles: tuple = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99),
+                       bins: int = 50):
+    """
+    Time between OrderBook snapshots
+    Statistics of the gaps between consecutive snapshots, obtained with a single np.diff
+    over the int64 nanosecond timestamps of the OrderBook.
+
+    Parameters
+    ----------
+    data_ob (OrderBooks) : Columnar OrderBook
+    quantiles (tuple) : Quantiles of the gaps to report
+    bins (int) : Number of bins of the histogram (log spaced between the smallest and the
+    largest positive gap)
+
+    Returns
+    -------
+    stats (Series) : Count, mean, median, std, min, max and quantiles of the gaps in milliseconds
+    hist_df (DataFrame) : Histogram of the gaps, with the bin edges in milliseconds
+    """
+    gaps = np.diff(data_ob.timestamps)/1e6
+    if not len(gaps):
+        return pd.Series({"count": 0}, dtype=np.float64), pd.DataFrame(columns=["From (ms)", "To (ms)", "Count"])
+    stats = pd.Series({
+        "count": len(gaps), "mean": gaps.mean(), "median": np.median(gaps), "std": gaps.std(ddof=1)
+        if len(gaps) > 1 else np.nan, "min": gaps.min(), "max": gaps.max(),
+        **{"q{:g}".format(i_q*100): i_value for i_q, i_value in zip(quantiles, np.quantile(gaps, quantiles))}
+    }, name="Time between snapshots (ms)")
+
+    positive = gaps[gaps > 0]
+    if len(positive) and positive.max() > positive.min():
+        edges = np.concatenate([[0.0], np.geomspace(positive.min(), positive.max(), bins)])
+    else:
+        edges = np.linspace(0.0, max(gaps.max(), 1.0), bins + 1)
+    counts, edges = np.histogram(gaps, bins=edges)
+    hist_df = pd.DataFrame({"From (ms)": edges[:-1], "To (ms)": edges[1:], "Count": counts})
+    return stats, hist_df
+
+
+def APT_engine(ob_df: pd.DataFrame = None, columns: list = None, freq: str = "1min"):
+    """
+    Asset Pricing Theory engine
+    Evaluates the martingale process (the best estimator of the next price is the current
+    one) for several price series at once, both over the whole sample and inside time
+    buckets of the given frequency. The series are stacked in a (snapshots x columns)
+    matrix, compared with their next value in a single shifted-equality mask and counted
+    per bucket with one np.bincount over (bucket, column) codes.
+
+    Parameters
+    ----------
+    ob_df (DataFrame) : DataFrame of prices indexed by timestamp, such as df_metrics
+    columns (list) : Columns to evaluate (all the columns of ob_df by default)
+    freq (str) : Bucket frequency ("1s", "1min", "5min", ...), None for the whole sample only
+
+    Returns
+    -------
+    APT_df (DataFrame) : amount and ratio of e1, e2 and total over the whole sample,
+    indexed by (column, test)
+    APT_dict_df (DataFrame) : e1, e2, total, ratio1 and ratio2 of every bucket, indexed
+    by (column, bucket) (None without freq)
+    APT_results_df (DataFrame) : Total of trades and mean of the bucket ratios, indexed
+    by column (None without freq)
+    """
+    columns = list(ob_df.columns) if columns is None else list(columns)
+    values = ob_df[columns].to_numpy(dtype=np.float64)
+    n_cols = len(columns)
+    n_pairs = max(len(values) - 1, 0)
+    # e1: prices exactly the same as their future counterpart, e2: those that are not
+    equal = values[1:] == values[:-1]
+
+    # Whole sample
+    e1_all = equal.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio1_all = np.round(e1_all/n_pairs, 2)
+        ratio2_all = np.round((n_pairs - e1_all)/n_pairs, 2)
+    APT_df = pd.DataFrame(
+        data={"amount": np.column_stack([e1_all, n_pairs - e1_all, np.full(n_cols, n_pairs)]).ravel(),
+              "ratio": np.column_stack([ratio1_all, ratio2_all, np.full(n_cols, n_pairs)]).ravel()},
+        index=pd.MultiIndex.from_product([columns, ["e1", "e2", "total"]], names=["column", "test"]))
+    if freq is None:
+        return APT_df, None, None
+
+    # Buckets: only pairs (t, t+1) inside the same bucket are counted
+    codes, buckets = pd.factorize(pd.DatetimeIndex(ob_df.index).floor(freq), sort=True)
+    n_buckets = len(buckets)
+    same = codes[1:] == codes[:-1]
+    total = np.bincount(codes[1:][same], minlength=n_buckets)
+    cells = codes[1:, None]*n_cols + np.arange(n_cols)
+    e1 = np.bincount(cells[same[:, None] & equal], minlength=n_buckets*n_cols).reshape(n_buckets, n_cols)
+    e2 = total[:, None] - e1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio1 = e1/total[:, None]
+        ratio2 = e2/total[:, None]
+
+    APT_dict_df = pd.DataFrame(
+        data={"e1": e1.T.ravel(), "e2": e2.T.ravel(), "total": np.tile(total, n_cols),
+              "ratio1": ratio1.T.ravel(), "ratio2": ratio2.T.ravel()},
+        index=pd.MultiIndex.from_product([columns, buckets], names=["column", "bucket"]))
+
+    # Totals, table (pairs between consecutive buckets are added back to the total)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        APT_results_df = pd.DataFrame(data = {
+            "Total trades" : total.sum() + max(n_buckets - 1, 0),
+            "E1 Ratio Mean" : np.nanmean(ratio1, axis=0),
+            "E2 Ratio Mean" : np.nanmean(ratio2, axis=0)
+        }, index = pd.Index(columns, name="column"))
+    return APT_df, APT_dict_df, APT_results_df
 
 
 def Model1_E1(midprices: pd.Series = None):
@@ -108,28 +258,31 @@ def Model1_E1(midprices: pd.Series = None):
 
 
     """
+    APT_df, _, _ = APT_engine(midprices.to_frame(name="price"), freq=None)
+    return APT_df.loc["price"].rename_axis(None)
 
 
+def martingale_test(prices: pd.Series = None, freq: str = "1min"):
+    """
+    Martingale test over time buckets of a single price series, see APT_engine.
 
+    Parameters
+    ----------
+    prices (Series) : Series of prices indexed by their timestamps
+    freq (str) : Bucket frequency ("1s", "1min", "5min", ...)
 
-    # Asset pricing model: Best estimator for future prices is current price
-    # Is it valid most of the time?
-    # e1: Martingale process for all midprices that are exactly the same as their future counterpart
-    e1 = [midprices[i] == midprices[i+1] for i in range(len(midprices)-1)]
-    # e2: Those midprices that ain't the same as their future counterparts.
-    e2 = [midprices[i] != midprices[i+1] for i in range(len(midprices)-1)] 
+    Returns
+    -------
+    APT_dict_df (DataFrame) : e1, e2, total, ratio1 and ratio2 of every bucket
+    APT_results_df (DataFrame) : Total of trades and mean of the ratios of all buckets
+    """
+    _, APT_dict_df, APT_results_df = APT_engine(prices.to_frame(name="price"), freq=freq)
+    APT_dict_df = APT_dict_df.loc["price"]
+    APT_dict_df.index.name = None
+    return APT_dict_df, APT_results_df.reset_index(drop=True)
 
-    # Collecting results on dictionary
-    APT_dict = {"e1" : {"amount" : np.round(sum(e1),2), "ratio" : np.round(sum(e1)/(len(midprices)-1),2)}, 
-                "e2" : {"amount" : np.round(sum(e2),2), "ratio" : np.round(sum(e2)/(len(midprices)-1),2)},
-                "total" : np.round(len(midprices)-1,2) }
 
-    # Printing Results as DataFrame
-    APT_df = pd.DataFrame(APT_dict).T
-    return APT_df
-    
-    
-def Model1_E2(midprices: pd.Series = None):
+def Model1_E2(midprices: pd.Series = None, freq: str = "1min"):
     """
     Model 1 Experiment 2: Asset Pricing Theory Hypothesis using minute-segmented data
     This function tests the APT Hypothesis on a minute-segmented data of the provided 
@@ -138,6 +291,7 @@ def Model1_E2(midprices: pd.Series = None):
     Parameters
     ----------
     midprices (Series) : Series containing both the midprices and its timestamps
+    freq (str) : Size of the segments ("1min" by default)
 
     Returns
     -------
@@ -150,67 +304,15 @@ def Model1_E2(midprices: pd.Series = None):
 
 
     """ 
-    
-    
-    midprices = pd.DataFrame(midprices)
     # Second Experiment (Every Minute Data)
-    # Separing timestamps into minutes data
-    dic = {} # Empty dictionary, used for storing midprices separed for every minute
-    for index, row in midprices.iterrows(): # Iterating over the timestamps, the rows of the midprices df
-        key = str(index.hour) + ":" + str(index.minute) # New key: Hour + Minute of the timestamp (used to avoid minute repetitions)
-        value = row["Mid Price"] # Value equals to the row value of the midprice at the iteration
-        try: # If succesful in finding the key (extracted above) append the value
-            dic[key].append(value)
-        except KeyError: # If not succesful in finding the key (extracted above) create the new key, with its first value being the value at the iteration
-            dic[key] = [value]
-
-    # Obtaining APT of each minute
-    APT_dict_min = {} # New empty dictionary
-    for i in list(dic): # Iterating over all the timestamps in the dic dictionary (the ones that are in the [hour:minute] format)
-        e1 = sum([dic[i][i_t] == dic[i][i_t+1] for i_t in range(len(dic[i])-1)]) # Martingale process, exactly the same as previous e1
-        e2 = sum([dic[i][i_t] != dic[i][i_t+1] for i_t in range(len(dic[i])-1)]) # same
-        APT_dict_min[i] = ( # Appending the newly created variables to the dictionary
-            {"e1" :{"amount" :  e1, "ratio" : e1/(len(dic[i])-1)}, 
-            "e2" :{"amount" :  e2, "ratio" : e2/(len(dic[i])-1)},
-            "total" : len(dic[i])-1
-            }
-            )
-
-    # Resuming results in a DataFrame
-    templiste1 = []
-    templiste2 = []
-    templisttot = []
-    templistp1 = []
-    templistp2 = []
-    for i in list(APT_dict_min):
-        templiste1.append(APT_dict_min[i]["e1"]["amount"])
-        templiste2.append(APT_dict_min[i]["e2"]["amount"])
-        templisttot.append(APT_dict_min[i]["total"])
-        templistp1.append(APT_dict_min[i]["e1"]["ratio"])
-        templistp2.append(APT_dict_min[i]["e2"]["ratio"])
-
-    APT_dict_df = {"e1":templiste1,
-                "e2":templiste2,
-                "total":templisttot,
-                "ratio1":templistp1,
-                "ratio2":templistp2}
-    APT_dict_df = pd.DataFrame(data=APT_dict_df)
-    APT_dict_df.index = list(APT_dict_min)
-
-    # Totals, table
-    APT_results_df = pd.DataFrame(data = {
-        "Total trades" : np.array(APT_dict_df["total"]).sum()+60,
-        "E1 Ratio Mean" : np.array(APT_dict_df["ratio1"]).mean(),
-        "E2 Ratio Mean" : np.array(APT_dict_df["ratio2"]).mean()
-    }, index = range(1))
-    return APT_dict_df,APT_results_df
-
-
-
-
-
-
-def Model1_E3(ob_df: pd.DataFrame = None):
+    return martingale_test(midprices, freq)
+
+
+
+
+
+
+def Model1_E3(ob_df: pd.DataFrame = None, freq: str = "1min"):
     """
     Model 1 Experiment 3: Asset Pricing Theory over Volme-Weighted-Mid Prices
     both for the entire data, and minute segmented data.
@@ -218,6 +320,7 @@ def Model1_E3(ob_df: pd.DataFrame = None):
     Parameters
     ----------
     ob_df (Dataframe) : OrderBook DataFrame containing the VWMP and the timestamps
+    freq (str) : Size of the segments ("1min" by default)
 
     Returns
     -------
@@ -230,74 +333,27 @@ def Model1_E3(ob_df: pd.DataFrame = None):
     """
 
 
-    Wmidprices = ob_df["Weighted MidPrice (Ask)"]
-
-    # Asset pricing model: Best estimator for future prices is current price
-    # Is it valid most of the time?
-    # e1: Martingale process for all midprices that are exactly the same as their future counterpart
-    e1 = [Wmidprices[i] == Wmidprices[i+1] for i in range(len(Wmidprices)-1)]
-    # e2: Those midprices that ain't the same as their future counterparts.
-    e2 = [Wmidprices[i] != Wmidprices[i+1] for i in range(len(Wmidprices)-1)] 
+    WAPT_df, WAPT_dict_df, WAPT_results_df = APT_engine(ob_df, ["Weighted MidPrice (Ask)"], freq)
+    # Whole sample and Every Minute Data of the single evaluated column
+    WAPT_df = WAPT_df.loc["Weighted MidPrice (Ask)"].rename_axis(None)
+    WAPT_dict_df = WAPT_dict_df.loc["Weighted MidPrice (Ask)"]
+    WAPT_dict_df.index.name = None
+    WAPT_results_df = WAPT_results_df.reset_index(drop=True)
+    return WAPT_df,WAPT_dict_df,WAPT_results_df
 
-    # Collecting results on dictionary
-    WAPT_dict = {"e1" : {"amount" : np.round(sum(e1),2), "ratio" : np.round(sum(e1)/(len(Wmidprices)-1),2)}, 
-                "e2" : {"amount" : np.round(sum(e2),2), "ratio" : np.round(sum(e2)/(len(Wmidprices)-1),2)},
-                "total" : np.round(len(Wmidprices)-1,2) }
 
-    # Printing Results as DataFrame
-    WAPT_df = pd.DataFrame(WAPT_dict).T
-    Wmidprices = pd.DataFrame(Wmidprices)
-    # Second Experiment (Every Minute Data)
-    # Separing timestamps into minutes data
-    dic = {} # Empty dictionary, used for storing midprices separed for every minute
-    for index, row in Wmidprices.iterrows(): # Iterating over the timestamps, the rows of the midprices df
-        key = str(index.hour) + ":" + str(index.minute) # New key: Hour + Minute of the timestamp (used to avoid minute repetitions)
-        value = row["Weighted MidPrice (Ask)"] # Value equals to the row value of the midprice at the iteration
-        try: # If succesful in finding the key (extracted above) append the value
-            dic[key].append(value)
-        except KeyError: # If not succesful in finding the key (extracted above) create the new key, with its first value being the value at the iteration
-            dic[key] = [value]
-
-    # Obtaining APT of each minute
-    WAPT_dict_min = {} # New empty dictionary
-    for i in list(dic): # Iterating over all the timestamps in the dic dictionary (the ones that are in the [hour:minute] format)
-        e1 = sum([dic[i][i_t] == dic[i][i_t+1] for i_t in range(len(dic[i])-1)]) # Martingale process, exactly the same as previous e1
-        e2 = sum([dic[i][i_t] != dic[i][i_t+1] for i_t in range(len(dic[i])-1)]) # same
-        WAPT_dict_min[i] = ( # Appending the newly created variables to the dictionary
-            {"e1" :{"amount" :  e1, "ratio" : e1/(len(dic[i])-1)}, 
-            "e2" :{"amount" :  e2, "ratio" : e2/(len(dic[i])-1)},
-            "total" : len(dic[i])-1
-            }
-            )
-
-    # Resuming results in a DataFrame
-    templiste1 = []
-    templiste2 = []
-    templisttot = []
-    templistp1 = []
-    templistp2 = []
-    for i in list(WAPT_dict_min):
-        templiste1.append(WAPT_dict_min[i]["e1"]["amount"])
-        templiste2.append(WAPT_dict_min[i]["e2"]["amount"])
-        templisttot.append(WAPT_dict_min[i]["total"])
-        templistp1.append(WAPT_dict_min[i]["e1"]["ratio"])
-        templistp2.append(WAPT_dict_min[i]["e2"]["ratio"])
-
-    WAPT_dict_df = {"e1":templiste1,
-                "e2":templiste2,
-                "total":templisttot,
-                "ratio1":templistp1,
-                "ratio2":templistp2}
-    WAPT_dict_df = pd.DataFrame(data=WAPT_dict_df)
-    WAPT_dict_df.index = list(WAPT_dict_min)
-
-    # Totals, table
-    WAPT_results_df = pd.DataFrame(data = {
-        "Total trades" : np.array(WAPT_dict_df["total"]).sum()+60,
-        "E1 Ratio Mean" : np.array(WAPT_dict_df["ratio1"]).mean(),
-        "E2 Ratio Mean" : np.array(WAPT_dict_df["ratio2"]).mean()
-    }, index = range(1))
-    return WAPT_df,WAPT_dict_df,WAPT_results_df
+def roll_cov(prices: np.ndarray = None):
+    """
+    Sample covariance (ddof=1) of the price changes vs the previous price changes, over
+    the pairs where both are defined, computed on NumPy arrays.
+    """
+    dP = np.diff(np.asarray(prices, dtype=np.float64))
+    x, y = dP[1:], dP[:-1]
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if len(x) < 2:
+        return np.nan
+    return np.dot(x - x.mean(), y - y.mean())/(len(x) - 1)
 
 
 def Model2(midprices: pd.DataFrame = None, ob_df: pd.DataFrame = None):
@@ -330,12 +386,8 @@ def Model2(midprices: pd.DataFrame = None, ob_df: pd.DataFrame = None):
     # This Model Uses the price change covariance to deduce the spread of the OrderBook
     # In order for us to find such Spread, first we need the price changes of the Mid Price
 
-    dP_t = midprices["Mid Price"].diff(1) # Present price changes
-    dP_t_1 = midprices["Mid Price"].shift(1).diff(1) # 1 instant in time shifted mid prices
-    # We now need to find this prices Covariance
-    cov = pd.DataFrame({
-        "dP_t" : dP_t, "dP_t_1" : dP_t_1
-    }).cov().iloc[1,0]
+    # Present price changes vs the 1 instant in time shifted ones, and this prices Covariance
+    cov = roll_cov(midprices["Mid Price"].to_numpy(dtype=np.float64))
     # Constant C is Sqrt(-cov)
     C = np.sqrt(-cov)
     # Spread is Supossed to be 2*C
@@ -359,8 +411,190 @@ def Model2(midprices: pd.DataFrame = None, ob_df: pd.DataFrame = None):
     roll_df_stats = pd.DataFrame({
         "Spread Mean" : roll_df["Spread (OB)"].mean(),
         "Spread Variance" : roll_df["Spread (OB)"].var(),
-        "Calculated Spread" : roll_df["Calculated Spread"][0]
+        "Calculated Spread" : roll_df["Calculated Spread"].iloc[0]
     },index = range(1))
     roll_df_stats["Spread Difference"] = roll_df_stats["Spread Mean"] - roll_df_stats["Calculated Spread"]
     return roll_df,roll_df_stats
 
+
+
+def Model2_rolling(midprices: pd.Series = None, window=500, min_periods: int = 2, on_positive: str = "nan"):
+    """
+    Model 2: Rolling Roll model
+    Time-varying version of the Roll spread estimator. For every tick, the covariance of
+    the price changes vs the previous price changes is computed over a trailing window
+    from running (cumulative) sums, so each update costs O(1) no matter the window size.
+
+    The Roll model is only defined for a negative covariance, for a positive one the
+    spread is set according to on_positive:
+    -"nan" : No estimate (same as np.sqrt(-cov) in Model2)
+    -"zero" : Spread of zero
+    -"ffill" : Last valid estimate
+
+    Parameters
+    ----------
+    midprices (Series) : Series (or DataFrame with a "Mid Price" column) of the prices
+    window (int or str) : Number of price change pairs, or a time span such as "5min"
+    min_periods (int) : Minimum number of pairs in the window to give an estimate
+    on_positive (str) : Treatment of windows with a positive covariance
+
+    Returns
+    -------
+    roll_df (DataFrame) : Autocovariance, number of pairs and Calculated Spread of every tick
+    """
+    if isinstance(midprices, pd.DataFrame):
+        midprices = midprices["Mid Price"]
+    if on_positive not in ("nan", "zero", "ffill"):
+        raise ValueError("on_positive must be 'nan', 'zero' or 'ffill'")
+    prices = midprices.to_numpy(dtype=np.float64)
+    n = len(prices)
+
+    # Pairs (dP_t, dP_t_1), defined from the third price on
+    dP = np.full(n, np.nan)
+    dP[1:] = np.diff(prices)
+    dP_t_1 = np.full(n, np.nan)
+    dP_t_1[1:] = dP[:-1]
+    valid = ~(np.isnan(dP) | np.isnan(dP_t_1))
+    # Centering does not change the covariance and keeps the running sums small
+    center = np.nanmean(dP) if valid.any() else 0.0
+    x = np.where(valid, dP - center, 0.0)
+    y = np.where(valid, dP_t_1 - center, 0.0)
+
+    # Running sums, with a leading 0 so the sum over (start, end] is S[end] - S[start]
+    def running(values):
+        return np.concatenate([[0.0], np.cumsum(values)])
+    S_n, S_x, S_y, S_xy = running(valid.astype(np.float64)), running(x), running(y), running(x*y)
+
+    end = np.arange(1, n + 1)
+    if isinstance(window, (int, np.integer)):
+        start = np.maximum(end - window, 0)
+    else:
+        ts = pd.DatetimeIndex(midprices.index).values.astype("datetime64[ns]").view(np.int64)
+        start = np.searchsorted(ts, ts - pd.Timedelta(window).value, side="right")
+
+    count = S_n[end] - S_n[start]
+    sum_x, sum_y = S_x[end] - S_x[start], S_y[end] - S_y[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = (S_xy[end] - S_xy[start] - sum_x*sum_y/count)/(count - 1)
+    cov[count < max(min_periods, 2)] = np.nan
+
+    # Constant C is Sqrt(-cov), Spread is Supossed to be 2*C
+    CalcSpread = 2*np.sqrt(np.where(cov <= 0, -cov, np.nan))
+    positive = cov > 0
+    if on_positive == "zero":
+        CalcSpread[positive] = 0.0
+    elif on_positive == "ffill":
+        CalcSpread = pd.Series(np.where(positive, np.nan, CalcSpread)).ffill().to_numpy()
+        CalcSpread[np.isnan(cov)] = np.nan
+
+    roll_df = pd.DataFrame(
+        data = {
+            "Autocovariance" : cov,
+            "Observations" : count.astype(np.int64),
+            "Calculated Spread" : CalcSpread
+        }, index = midprices.index
+    )
+    return roll_df
+
+
+def autocovariance(x: np.ndarray = None, max_lag: int = None, unbiased: bool = False, demean: bool = True):
+    """
+    Autocovariance function via FFT
+    Autocovariances of a series for the lags 0..max_lag in O(n log n): the (demeaned)
+    series is zero padded to at least 2n - 1 points, so the inverse FFT of its power
+    spectrum gives the linear (not circular) sums of x_t*x_t+k for every lag at once.
+    NaN values (such as the first price change) are dropped.
+
+    Parameters
+    ----------
+    x (np.ndarray) : Series, such as the price changes
+    max_lag (int) : Largest lag (n - 1 by default)
+    unbiased (bool) : Divide the sum of lag k by n - k instead of n
+    demean (bool) : Subtract the mean (False assumes a zero mean series)
+
+    Returns
+    -------
+    acov (np.ndarray) : Autocovariance of the lags 0..max_lag
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x = x[~np.isnan(x)]
+    n = len(x)
+    if n == 0:
+        return np.full((max_lag or 0) + 1, np.nan)
+    max_lag = n - 1 if max_lag is None else min(max_lag, n - 1)
+    if demean:
+        x = x - x.mean()
+    n_fft = 1 << (2*n - 1).bit_length()
+    spectrum = np.fft.rfft(x, n_fft)
+    sums = np.fft.irfft(spectrum*np.conj(spectrum), n_fft)[:max_lag + 1]
+    return sums/(n - np.arange(max_lag + 1) if unbiased else n)
+
+
+def roll_estimators(prices: np.ndarray = None, max_lag: int = 10):
+    """
+    Roll-family spread estimators of one price series
+    Every estimator is 2*Sqrt(-gamma) for an estimate gamma of the autocovariance of the
+    price changes, NaN when gamma is positive. They come from one FFT autocovariance pass:
+    -Roll : Sample covariance of dP_t vs dP_t_1 (ddof=1), the estimate of Model2
+    -Roll (unbiased) : Lag 1 autocovariance divided by n - 1 instead of n
+    -Roll (zero mean) : Lag 1 autocovariance assuming the price changes have mean 0, as
+    in Hasbrouck's formulation where the efficient price is a random walk without drift
+    -Roll (bias corrected) : Lag 1 autocovariance plus its first order small sample
+    bias, (gamma_0 + 2*gamma_1)/n
+    -Roll (max_lag lags) : Sum of the autocovariances of lags 1..max_lag, which also
+    captures reversals spread over several ticks
+
+    Parameters
+    ----------
+    prices (np.ndarray) : Prices, in tick order
+    max_lag (int) : Largest lag of the multi-lag estimator
+
+    Returns
+    -------
+    estimators (Series) : Calculated Spread of every estimator
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    dP = np.diff(prices)
+    dP = dP[~np.isnan(dP)]
+    n = len(dP)
+    acov = autocovariance(dP, max_lag)
+    acov_unbiased = acov*n/(n - np.arange(len(acov))) if n else acov
+    acov_zero = autocovariance(dP, 1, demean=False)
+    gamma = {
+        "Roll" : roll_cov(prices),
+        "Roll (unbiased)" : acov_unbiased[1] if len(acov) > 1 else np.nan,
+        "Roll (zero mean)" : acov_zero[1] if len(acov_zero) > 1 else np.nan,
+        "Roll (bias corrected)" : acov[1] + (acov[0] + 2*acov[1])/n if len(acov) > 1 else np.nan,
+        "Roll ({} lags)".format(max_lag) : acov[1:].sum() if len(acov) > 1 else np.nan
+    }
+    gamma = pd.Series(gamma, dtype=np.float64)
+    # Constant C is Sqrt(-gamma), Spread is Supossed to be 2*C
+    return 2*np.sqrt(-gamma.where(gamma <= 0))
+
+
+def Model2_variants(ob_df: pd.DataFrame = None, columns: list = None, max_lag: int = 10):
+    """
+    Model 2: Roll model variants
+    Evaluates the Roll-family estimators of roll_estimators over several price columns of
+    df_metrics, working on the NumPy arrays of the columns (no intermediate DataFrames).
+
+    Parameters
+    ----------
+    ob_df (DataFrame) : df_metrics DataFrame
+    columns (list) : Price columns (Mid Price, Weighted MidPrice (Ask) and Volume Weighted
+    Average Price by default)
+    max_lag (int) : Largest lag of the autocovariance function and the multi-lag estimator
+
+    Returns
+    -------
+    roll_variants_df (DataFrame) : Calculated Spread of every estimator (rows) and column
+    acov_df (DataFrame) : Autocovariance of the price changes of every column, by lag
+    """
+    if columns is None:
+        columns = ["Mid Price", "Weighted MidPrice (Ask)", "Volume Weighted Average Price"]
+    roll_variants_df = pd.DataFrame({i_col: roll_estimators(ob_df[i_col].to_numpy(dtype=np.float64), max_lag)
+                                     for i_col in columns})
+    acov_df = pd.DataFrame({i_col: autocovariance(np.diff(ob_df[i_col].to_numpy(dtype=np.float64)), max_lag)
+                            for i_col in columns})
+    acov_df.index.name = "lag"
+    return roll_variants_df, acov_df
@@ -9,44 +9,238 @@
 # -- --------------------------------------------------------------------------------------------------- -- #
 """
 
+import argparse
+import glob
+import os
+import sys
+
 import pandas as pd
 import data as dt
-import numpy as np
 import functions
-import visualizations
-
-# Obtaining JSON file from data library (Filename: files/orderbooks_05jul21)
-data_ob = dt.ob_data
-# Orderbook timestamps
-ob_ts = list(data_ob.keys())
-# Timestamp listings
-l_ts = [pd.to_datetime(i_ts) for i_ts in ob_ts]
-# MODEL 1 - ASSET PRICING THEORY
-# First Experiment - All midpricess in orderbook
-# Metrics from Functions library
-ob_df,_,_ = functions.df_metrics(data_ob)
-# midpricess from metrics dataframe
-midprices = ob_df["Mid Price"]
-# Experiment 1
-#functions.Model1_E1(midprices)
-# Experiment 2
-x,y = functions.Model1_E2(midprices)
-g1 = visualizations.APT_graph(x)
-g1.show()
-
-#################################################################################################################
-# Experiment 3: Martingale Process with Weighted MidPrice
-# Wmidprices from metrics dataframe
-
-functions.Model1_E3(ob_df)
-
-#################################################################################################################
-# MODEL 2 - ROLL MODEL
-roll1, roll2 = functions.Model2(pd.DataFrame(midprices),ob_df)
-
-g2 = visualizations.Model2_TS_observed(roll1)
-g2.show()
-
-g3 = visualizations.Model2_TS_Theoretical(roll1)
-g3.show()
+import resampling
+from batch import file_labels, run_pairs
+from profiling import Profiler
+from cache import ResultCache
+
+# Models that can be selected from the command line
+models = ["metrics", "e1", "e2", "e3", "roll"]
+
+
+def write_table(df: pd.DataFrame = None, output_dir: str = None, name: str = None, fmt: str = "csv"):
+    """Writes a result table as Parquet or CSV inside output_dir, returns its location."""
+    filename = os.path.join(output_dir, "{}.{}".format(name, fmt))
+    if fmt == "parquet":
+        # Parquet needs string column names
+        df = df.copy()
+        df.columns = [str(i_col) for i_col in df.columns]
+        df.to_parquet(filename)
+    else:
+        df.to_csv(filename)
+    return filename
+
+
+def run(path: str = dt.filename, exchange: str = "bitfinex", selected: list = None, freq: str = "1min",
+        start: str = None, end: str = None, sampling: str = None, dedup: bool = False,
+        output_dir: str = "files/output", fmt: str = "csv", plots: bool = True, plot_format: str = "html",
+        use_cache: bool = True, profiler: Profiler = None, name: str = None):
+    """
+    Runs the selected models over one exchange of one orderbooks file and writes their
+    tables (and figures) to output_dir, named <name>_<exchange>_<table>.
+
+    Parameters
+    ----------
+    path (str) : Location of the orderbooks JSON file
+    exchange (str) : Exchange to evaluate
+    selected (list) : Models to run, any of metrics, e1, e2, e3 and roll (all by default)
+    freq (str) : Bucket frequency of experiments 2 and 3
+    start, end (str) : Time range of the snapshots (start <= timestamp < end)
+    sampling (str) : Sampling of the metrics every model runs on, see resampling.resample
+    (None for every snapshot)
+    dedup (bool) : Compute the metrics once per distinct book (see data.DedupOrderBooks)
+    output_dir (str) : Folder of the outputs
+    fmt (str) : Format of the tables, "csv" or "parquet" (requires pyarrow)
+    plots (bool) : Whether to build and save the figures
+    plot_format (str) : Extension of the figures ("html", or "png" and "svg" with kaleido)
+    use_cache (bool) : Whether to reuse model results from the results cache
+    profiler (Profiler) : Profiler of the stages (a new one by default), stages are named
+    <name>_<exchange>:<stage>
+    name (str) : Label of the file in the outputs (the file name without extension by default)
+
+    Returns
+    -------
+    written (list) : Locations of the files written
+    """
+    selected = models if selected is None else selected
+    profiler = Profiler() if profiler is None else profiler
+    # Model outputs are reused between runs while the data, the models and their parameters are the same
+    results = ResultCache() if use_cache else ResultCache(directory=None, memory_items=0)
+    name = os.path.splitext(os.path.basename(path))[0] if name is None else name
+    prefix = "{}_{}".format(name, exchange)
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+
+    def save(df, name):
+        written.append(write_table(df, output_dir, "{}_{}".format(prefix, name), fmt))
+
+    def stage(name):
+        # Stages are labelled with the pair, so the report of several pairs can be told apart
+        return profiler.stage("{}:{}".format(prefix, name))
+
+    if plots:
+        # Plotly is only imported when figures are requested
+        import visualizations
+
+        def save_figure(fig, name):
+            filename = os.path.join(output_dir, "{}_{}.{}".format(prefix, name, plot_format))
+            written.append(visualizations.save_figure(fig, filename))
+
+    with stage("load"):
+        # Obtaining JSON file from data library, loaded on request
+        data_ob = dt.load_orderbooks(path, exchange, start, end, dedup=dedup)
+
+    # MODEL 1 - ASSET PRICING THEORY
+    with stage("df_metrics"):
+        # Metrics from Functions library
+        ob_df, _, _ = results.call(functions.df_metrics, data_ob)
+        if sampling is not None:
+            # Clock, tick, volume or change only bars of the metrics
+            ob_df = resampling.resample(ob_df, sampling)
+        # midpricess from metrics dataframe
+        midprices = ob_df["Mid Price"]
+    if "metrics" in selected:
+        with stage("timestamps"):
+            # Statistics of the time between snapshots
+            ts_stats, ts_hist = functions.interarrival_stats(data_ob)
+        save(ob_df, "metrics")
+        save(ts_stats.to_frame(), "interarrival")
+
+    # Experiment 1: All midpricess in orderbook
+    if "e1" in selected:
+        with stage("Model1_E1"):
+            save(results.call(functions.Model1_E1, midprices), "M1_E1")
+
+    # Experiment 2: Segmented midprices
+    if "e2" in selected:
+        with stage("Model1_E2"):
+            x, y = results.call(functions.Model1_E2, midprices, freq)
+            save(x, "M1_E2_buckets")
+            save(y, "M1_E2_results")
+        if plots:
+            with stage("APT_graph"):
+                save_figure(visualizations.APT_graph(x), "M1_E2")
+
+    # Experiment 3: Martingale Process with Weighted MidPrice
+    if "e3" in selected:
+        with stage("Model1_E3"):
+            w1, w2, w3 = results.call(functions.Model1_E3, ob_df, freq)
+            save(w1, "M1_E3")
+            save(w2, "M1_E3_buckets")
+            save(w3, "M1_E3_results")
+        if plots:
+            with stage("APT_graph_w"):
+                save_figure(visualizations.APT_graph_w(w2), "M1_E3")
+
+    # MODEL 2 - ROLL MODEL
+    if "roll" in selected:
+        with stage("Model2"):
+            roll1, roll2 = results.call(functions.Model2, pd.DataFrame(midprices), ob_df)
+            save(roll1, "M2_roll")
+            save(roll2, "M2_stats")
+            # Roll-family estimators over the mid, weighted mid and VWAP columns
+            roll3, acov = results.call(functions.Model2_variants, ob_df)
+            save(roll3, "M2_variants")
+            save(acov, "M2_autocovariance")
+        if plots:
+            with stage("Model2_graphs"):
+                save_figure(visualizations.Model2_TS_observed(roll1), "M2_observed")
+                save_figure(visualizations.Model2_TS_Theoretical(roll1), "M2_theoretical")
+    return written
+
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Microstructure models (APT martingale tests and Roll spread) over recorded orderbooks")
+    parser.add_argument("inputs", nargs="*", default=[dt.filename],
+                        help="Orderbooks JSON files or globs (default: %(default)s)")
+    parser.add_argument("-x", "--exchange", nargs="+", default=["bitfinex"], help="Exchanges to evaluate")
+    parser.add_argument("--start", help="First timestamp evaluated (inclusive)")
+    parser.add_argument("--end", help="Last timestamp evaluated (exclusive)")
+    parser.add_argument("-m", "--models", nargs="+", choices=models, default=models, help="Models to run")
+    parser.add_argument("-s", "--sampling", default=None,
+                        help="Sampling of the metrics: clock[:1s], tick[:100], volume[:units] or change[:column]")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Store repeated consecutive books once and compute their metrics once")
+    parser.add_argument("--freq", default="1min", help="Bucket frequency of experiments 2 and 3")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Processes used when there are several (file, exchange) pairs")
+    parser.add_argument("-o", "--output-dir", default="files/output", help="Folder of the tables and figures")
+    parser.add_argument("-f", "--format", choices=["csv", "parquet"], default="csv",
+                        help="Format of the tables (parquet requires pyarrow)")
+    parser.add_argument("--plot-format", default="html",
+                        help="Extension of the figures (html, or png/svg with kaleido)")
+    parser.add_argument("--no-plots", action="store_true", help="Skip the figures and the Plotly import")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every model")
+    parser.add_argument("--profile", default=os.environ.get("LAB2_PROFILE"),
+                        help="Extra profiling: tracemalloc, cprofile or all (stage timings are always reported)")
+    return parser.parse_args(argv)
+
+
+def run_pair(path: str = None, exchange: str = None, profile: str = None, names: dict = None, **options):
+    """
+    Unit of work of main for one (file, exchange) pair, in this process or a worker: runs
+    it with its own Profiler (and the output name of the file, from names) and returns the
+    files written and the profiled stages.
+    """
+    profiler = Profiler(profile)
+    written = run(path, exchange, profiler=profiler, name=names[path], **options)
+    return written, profiler.stages
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    paths = []
+    for i_input in args.inputs:
+        matches = sorted(glob.glob(i_input))
+        if not matches:
+            sys.exit("No orderbooks file matches {}".format(i_input))
+        paths += matches
+    pairs = [(i_path, i_exchange) for i_path in paths for i_exchange in args.exchange]
+    # Output names are the paths relative to the folder of all the files, so that files
+    # with the same name in different folders do not overwrite each other
+    try:
+        labels = file_labels(paths)
+    except ValueError as error:
+        sys.exit(str(error))
+    names = {i_path: os.path.splitext(i_label)[0].replace(os.sep, "_") for i_path, i_label in labels.items()}
+    if len(set(names.values())) < len(names):
+        sys.exit("Orderbooks files with the same output name: {}".format(", ".join(paths)))
+    options = dict(selected=args.models, freq=args.freq, start=args.start, end=args.end, sampling=args.sampling,
+                   dedup=args.dedup, output_dir=args.output_dir, fmt=args.format, plots=not args.no_plots,
+                   plot_format=args.plot_format, use_cache=not args.no_cache)
+
+    # Every (file, exchange) pair runs in its own process when there are several workers,
+    # each one writes its own outputs and sends back its profiled stages
+    workers = args.workers if len(pairs) > 1 else 1
+    results, errors = run_pairs(run_pair, pairs, workers, profile=args.profile, names=names, **options)
+    for (i_path, i_exchange), i_error in errors.items():
+        print("{} {}: {}".format(i_path, i_exchange, i_error), file=sys.stderr)
+
+    # Stage timings are always collected, --profile adds memory and hot functions
+    profiler = Profiler(args.profile)
+    written = []
+    for i_written, i_stages in results.values():
+        written += i_written
+        profiler.stages += i_stages
+    if profiler.stages:
+        profiler.print_report()
+        os.makedirs(args.output_dir, exist_ok=True)
+        profiler.to_json(os.path.join(args.output_dir, "profile_report.json"))
+    print("{} files written to {}".format(len(written), args.output_dir))
+    if errors:
+        # Scheduled runs have to see the failed pairs in the exit status
+        sys.exit("{} of {} (file, exchange) pairs failed".format(len(errors), len(pairs)))
+    return written
+
 
+if __name__ == "__main__":
+    main()
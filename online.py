@@ -0,0 +1,125 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: online.py : python script with the streaming versions of the models                         -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import numpy as np
+
+
+def _level_sum(values=None):
+    """
+    Sum of the levels of one side, added like pandas Series.sum() (NaN as 0, NumPy
+    pairwise summation) as in df_metrics, so both give the same value after np.round(..., 6).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return float(np.where(np.isnan(values), 0.0, values).sum())
+
+
+class OnlineMetrics:
+    """
+    Online OrderBook metrics
+    Streaming counterpart of functions.df_metrics, Model1_E1 and Model2. Every call to
+    update receives one live snapshot and returns its 9 df_metrics columns, the running
+    martingale counts (e1, e2) of the Mid Price and the running Roll spread. The work of
+    an update is proportional to the levels of the snapshot and the state is a handful
+    of numbers, so memory does not grow with the number of snapshots.
+
+    The Roll covariance is updated with Welford's co-moment recurrence, which gives the
+    same result as the batch covariance of Model2 without keeping the price history.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.e1 = 0
+        self.e2 = 0
+        self.last_mid = None
+        self.last_dP = None
+        # Welford state of the (dP_t, dP_t_1) pairs
+        self.pairs = 0
+        self.mean_dP_t = 0.0
+        self.mean_dP_t_1 = 0.0
+        self.comoment = 0.0
+
+    @property
+    def cov(self):
+        """Covariance of the price changes vs the previous price changes so far."""
+        return self.comoment/(self.pairs - 1) if self.pairs > 1 else np.nan
+
+    @property
+    def spread(self):
+        """Roll spread estimate so far, 2*Sqrt(-cov) (NaN for a positive covariance)."""
+        cov = self.cov
+        return 2*np.sqrt(-cov) if cov <= 0 else np.nan
+
+    def _update_roll(self, mid: float = None):
+        if self.last_mid is not None:
+            dP = mid - self.last_mid
+            if self.last_dP is not None:
+                self.pairs += 1
+                delta = dP - self.mean_dP_t
+                self.mean_dP_t += delta/self.pairs
+                self.mean_dP_t_1 += (self.last_dP - self.mean_dP_t_1)/self.pairs
+                self.comoment += delta*(self.last_dP - self.mean_dP_t_1)
+            self.last_dP = dP
+
+    def update(self, timestamp=None, snapshot=None):
+        """
+        Adds one snapshot to the running models.
+
+        Parameters
+        ----------
+        timestamp : Timestamp of the snapshot, returned as is
+        snapshot (dict) : bid_size, bid, ask and ask_size levels of the snapshot (a JSON
+        snapshot, a DataFrame or a data.Snapshot view)
+
+        Returns
+        -------
+        metrics (dict) : df_metrics columns, e1, e2 and Calculated Spread after the snapshot
+        """
+        bid, ask = float(snapshot["bid"][0]), float(snapshot["ask"][0])
+        # Spread and MidPrice
+        spread = ask - bid
+        mid = (ask + bid)*0.5
+        # Bid, Ask and Total Volume, each rounded once from the raw level sums
+        bid_sum, ask_sum = _level_sum(snapshot["bid_size"]), _level_sum(snapshot["ask_size"])
+        bid_volume = np.round(bid_sum, 6)
+        ask_volume = np.round(ask_sum, 6)
+        total_volume = np.round(bid_sum + ask_sum, 6)
+        # Orderbook Imbalance and weighted prices
+        imbalance = bid_volume/total_volume
+        wmid_ask = imbalance*mid
+        wmid_bid = ask_volume/(bid_volume + ask_volume)*bid + imbalance*ask
+        vwap = np.round((bid*bid_volume + ask*ask_volume)/(bid_volume + ask_volume), 6)
+
+        # Martingale counts of the Mid Price
+        if self.last_mid is not None:
+            if mid == self.last_mid:
+                self.e1 += 1
+            else:
+                self.e2 += 1
+        self._update_roll(mid)
+        self.last_mid = mid
+        self.count += 1
+
+        return {
+            "timestamp" : timestamp,
+            "Spread" : spread,
+            "Mid Price" : mid,
+            "Bid Volume" : bid_volume,
+            "Ask Volume" : ask_volume,
+            "Total Volume" : total_volume,
+            "OrderBook Imbalance" : imbalance,
+            "Weighted MidPrice (Ask)" : wmid_ask,
+            "Weighted MidPrice (Bid)" : wmid_bid,
+            "Volume Weighted Average Price" : vwap,
+            "e1" : self.e1,
+            "e2" : self.e2,
+            "Calculated Spread" : self.spread
+        }
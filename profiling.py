@@ -0,0 +1,122 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: profiling.py : python script with the pipeline instrumentation                              -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class Profiler:
+    """
+    Pipeline profiler
+    Measures every stage of a run wrapped in profiler.stage(name): wall and CPU time
+    always, and optionally the memory allocated (tracemalloc) and the hottest functions
+    (cProfile) of the stage. Both optional modes slow the run down, so they are off unless
+    requested.
+
+    Parameters
+    ----------
+    modes (str or list) : Optional modes, "tracemalloc" and/or "cprofile" (a comma separated
+    string such as "tracemalloc,cprofile" is accepted, "all" enables both)
+    top (int) : Number of functions kept per stage in cprofile mode
+
+    """
+
+    def __init__(self, modes=None, top: int = 15):
+        if isinstance(modes, str):
+            modes = [i_mode.strip() for i_mode in modes.split(",") if i_mode.strip()]
+        modes = set(modes or [])
+        if "all" in modes:
+            modes = {"tracemalloc", "cprofile"}
+        unknown = modes - {"tracemalloc", "cprofile", "time"}
+        if unknown:
+            raise ValueError("Unknown profiling modes: {}".format(", ".join(sorted(unknown))))
+        self.memory = "tracemalloc" in modes
+        self.cprofile = "cprofile" in modes
+        self.top = top
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str = None):
+        """Context manager that measures the code run inside it as the stage name."""
+        record = {"stage": name}
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if self.cprofile else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record["seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["allocated_mb"] = (current - memory_start)/2**20
+                record["peak_mb"] = (peak - memory_start)/2**20
+                if started_tracing:
+                    tracemalloc.stop()
+            if profile is not None:
+                record["functions"] = self._top_functions(profile)
+            self.stages.append(record)
+
+    def _top_functions(self, profile: cProfile.Profile = None):
+        # Hottest functions of the stage by cumulative time
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        rows = []
+        for (i_file, i_line, i_func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({"function": "{}:{}({})".format(i_file, i_line, i_func), "calls": calls,
+                         "tottime": tottime, "cumtime": cumtime})
+        return sorted(rows, key=lambda row: row["cumtime"], reverse=True)[:self.top]
+
+    def report(self):
+        """
+        Returns
+        -------
+        report_df (DataFrame) : One row per stage with its times (and memory), plus a Total
+        row and the share of the total wall time of every stage
+        """
+        columns = ["stage", "seconds", "cpu_seconds"] + (["allocated_mb", "peak_mb"] if self.memory else [])
+        report_df = pd.DataFrame([{i_col: i_stage.get(i_col) for i_col in columns} for i_stage in self.stages],
+                                 columns=columns).set_index("stage")
+        total = report_df["seconds"].sum()
+        report_df.loc["Total"] = report_df.sum()
+        if self.memory:
+            report_df.loc["Total", "peak_mb"] = report_df["peak_mb"].drop("Total").max()
+        report_df["share"] = report_df["seconds"]/total if total > 0 else 0.0
+        return report_df
+
+    def to_json(self, filename: str = None):
+        """Writes the stages (with the cProfile functions, if any) as JSON."""
+        with open(filename, "w") as file:
+            json.dump({"date": pd.Timestamp.now(tz="UTC").isoformat(), "stages": self.stages}, file, indent=2)
+
+    def print_report(self):
+        """Prints the report table and, in cprofile mode, the hottest functions of each stage."""
+        print(self.report().to_string(float_format=lambda value: "{:.4f}".format(value)))
+        if self.cprofile:
+            for i_stage in self.stages:
+                print("\n{} (top {} by cumulative time)".format(i_stage["stage"], self.top))
+                print(pd.DataFrame(i_stage["functions"]).to_string(index=False))
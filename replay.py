@@ -0,0 +1,136 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: replay.py : python script to replay recorded orderbooks over time                           -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import asyncio
+import inspect
+
+import numpy as np
+
+from online import OnlineMetrics
+
+
+class Replayer:
+    """
+    OrderBook replayer
+    Emits the recorded snapshots of an OrderBooks store in timestamp order to a set of
+    async consumers, as if they were arriving from a live feed. Every consumer has its
+    own bounded queue, so a slow consumer blocks the replay (backpressure) instead of
+    letting snapshots pile up in memory.
+
+    Parameters
+    ----------
+    orderbooks (OrderBooks) : Recorded snapshots, such as data.load_orderbooks()
+    speed (float) : 1 for real time, N for N times faster, None for as fast as possible
+    maxsize (int) : Maximum number of snapshots waiting in each consumer queue
+
+    """
+
+    def __init__(self, orderbooks=None, speed: float = 1.0, maxsize: int = 1000):
+        self.orderbooks = orderbooks
+        self.speed = speed
+        self.maxsize = maxsize
+
+    def _snapshot(self, i_pos: int = None):
+        # Level views of one snapshot, no copy of the columnar arrays
+        return self.orderbooks.view(i_pos)
+
+    async def _produce(self, queues: list = None, stats: dict = None):
+        loop = asyncio.get_running_loop()
+        timestamps = self.orderbooks.timestamps
+        keys = self.orderbooks.keys()
+        start = loop.time()
+        for i_pos in range(len(timestamps)):
+            # Wall clock time at which the snapshot is due (right now when there is no pacing)
+            if self.speed is None:
+                due = loop.time()
+            else:
+                due = start + (timestamps[i_pos] - timestamps[0])/1e9/self.speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            item = (due, keys[i_pos], self._snapshot(i_pos))
+            for i_queue in queues:
+                await i_queue.put(item)
+            stats["emitted"] += 1
+        for i_queue in queues:
+            await i_queue.put(None)
+
+    async def _consume(self, consumer=None, queue: asyncio.Queue = None, stats: dict = None):
+        loop = asyncio.get_running_loop()
+        lags = []
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            due, timestamp, snapshot = item
+            result = consumer(timestamp, snapshot)
+            if inspect.isawaitable(result):
+                await result
+            # Lag: time between the snapshot being due and the consumer finishing it
+            lags.append(loop.time() - due)
+        lags = np.array(lags)
+        stats.update({
+            "processed": len(lags),
+            "mean_lag_ms": float(lags.mean()*1000) if len(lags) else np.nan,
+            "p99_lag_ms": float(np.percentile(lags, 99)*1000) if len(lags) else np.nan,
+            "max_lag_ms": float(lags.max()*1000) if len(lags) else np.nan,
+        })
+
+    async def run(self, consumers: list = None):
+        """
+        Replays all the snapshots to the consumers.
+
+        Parameters
+        ----------
+        consumers (list) : Callables consumer(timestamp, snapshot), either functions or
+        coroutine functions. snapshot is a data.Snapshot with the bid_size, bid, ask and
+        ask_size levels.
+
+        Returns
+        -------
+        stats (dict) : Snapshots emitted, elapsed seconds, achieved snapshots/sec and the
+        lag of every consumer
+        """
+        loop = asyncio.get_running_loop()
+        queues = [asyncio.Queue(maxsize=self.maxsize) for _ in consumers]
+        stats = {"emitted": 0, "consumers": [{} for _ in consumers]}
+        start = loop.time()
+        await asyncio.gather(self._produce(queues, stats),
+                             *[self._consume(i_consumer, i_queue, i_stats) for i_consumer, i_queue, i_stats
+                               in zip(consumers, queues, stats["consumers"])])
+        stats["elapsed_s"] = loop.time() - start
+        stats["snapshots_per_s"] = stats["emitted"]/stats["elapsed_s"] if stats["elapsed_s"] > 0 else np.nan
+        return stats
+
+
+def metrics_consumer(results: list = None):
+    """
+    Consumer that runs OnlineMetrics over the replayed snapshots, appending the metrics of
+    every snapshot to results when a list is given.
+    """
+    metrics = OnlineMetrics()
+
+    async def consumer(timestamp, snapshot):
+        row = metrics.update(timestamp, snapshot)
+        if results is not None:
+            results.append(row)
+
+    consumer.metrics = metrics
+    return consumer
+
+
+def replay(orderbooks=None, consumers: list = None, speed: float = None, maxsize: int = 1000):
+    """
+    Runs a Replayer to completion from synchronous code, by default as fast as possible
+    through an OnlineMetrics consumer, and returns its stats.
+    """
+    consumers = [metrics_consumer()] if consumers is None else consumers
+    return asyncio.run(Replayer(orderbooks, speed, maxsize).run(consumers))
@@ -0,0 +1,149 @@
+
+"""
+# -- --------------------------------------------------------------------------------------------------- -- #
+# -- project: Microstructure and Trading Systems - Lab 2 Models                                          -- #
+# -- script: resampling.py : python script with the clock and event time samplings of the metrics        -- #
+# -- author: Xarenyglp                                                                                   -- #
+# -- license: THE LICENSE TYPE AS STATED IN THE REPOSITORY                                               -- #
+# -- repository: https://github.com/Xarenyglp/Lab2-Model                                                 -- #
+# -- --------------------------------------------------------------------------------------------------- -- #
+"""
+
+import numpy as np
+import pandas as pd
+
+# Samplings of resample, with the default value of their parameter
+samplings = {"clock": "1s", "tick": 100, "volume": None, "change": "Mid Price"}
+
+
+def _bars(ob_df: pd.DataFrame = None, positions: np.ndarray = None, index=None):
+    """
+    Metrics of the snapshot that closes every bar (the last one of the bar), plus the
+    number of snapshots of the bar in the Snapshots column.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    bars_df = ob_df.iloc[positions].copy()
+    bars_df["Snapshots"] = np.diff(np.concatenate([[-1], positions]))
+    if index is not None:
+        bars_df.index = index
+    return bars_df
+
+
+def clock_bars(ob_df: pd.DataFrame = None, freq: str = "1s"):
+    """
+    Clock time sampling
+    Metrics in force at the end of every period of freq, the last snapshot at or before
+    the end of the period, found with one searchsorted over the timestamps. Periods
+    without snapshots repeat the previous values (with 0 Snapshots).
+
+    Parameters
+    ----------
+    ob_df (DataFrame) : df_metrics DataFrame
+    freq (str) : Length of the periods ("1s", "1min", ...)
+
+    Returns
+    -------
+    bars_df (DataFrame) : Metrics of every period, indexed by the end of the period
+    """
+    if len(ob_df) == 0:
+        return _bars(ob_df, [])
+    edges = pd.date_range(ob_df.index[0].ceil(freq), ob_df.index[-1].ceil(freq), freq=freq)
+    ts = ob_df.index.values.astype("datetime64[ns]").view(np.int64)
+    ends = np.searchsorted(ts, edges.values.astype("datetime64[ns]").view(np.int64), side="right")
+    bars_df = _bars(ob_df, ends - 1, edges)
+    bars_df["Snapshots"] = np.diff(np.concatenate([[0], ends]))
+    return bars_df
+
+
+def tick_bars(ob_df: pd.DataFrame = None, ticks: int = 100):
+    """
+    Tick sampling
+    Metrics of every ticks-th snapshot, so every bar holds the same number of snapshots
+    (the last, shorter bar is kept).
+    """
+    positions = np.arange(ticks - 1, len(ob_df), ticks)
+    if len(ob_df) and (len(positions) == 0 or positions[-1] != len(ob_df) - 1):
+        positions = np.append(positions, len(ob_df) - 1)
+    return _bars(ob_df, positions)
+
+
+def volume_bars(ob_df: pd.DataFrame = None, volume: float = None, column: str = "Total Volume"):
+    """
+    Volume sampling
+    Closes a bar every time the running sum of the Total Volume of the snapshots
+    crosses a multiple of volume: the bar ends are a searchsorted of the multiples over
+    the cumulative sum, so busy periods give more bars.
+
+    Parameters
+    ----------
+    ob_df (DataFrame) : df_metrics DataFrame
+    volume (float) : Volume of every bar (by default, the one giving about 100 snapshots per bar)
+    column (str) : Volume column
+
+    Returns
+    -------
+    bars_df (DataFrame) : Metrics of the snapshot closing every bar
+    """
+    cum_volume = np.nancumsum(ob_df[column].to_numpy(dtype=np.float64))
+    if len(cum_volume) == 0 or cum_volume[-1] <= 0:
+        return _bars(ob_df, np.arange(len(ob_df))[-1:])
+    if volume is None:
+        volume = cum_volume[-1]/max(len(cum_volume)//100, 1)
+    targets = np.arange(1, int(cum_volume[-1]//volume) + 1)*volume
+    positions = np.unique(np.searchsorted(cum_volume, targets, side="left"))
+    if len(positions) == 0 or positions[-1] != len(ob_df) - 1:
+        positions = np.append(positions, len(ob_df) - 1)
+    return _bars(ob_df, positions)
+
+
+def change_bars(ob_df: pd.DataFrame = None, column: str = "Mid Price"):
+    """
+    Change only sampling
+    Keeps the first snapshot and every snapshot where column differs from the previous
+    one, dropping the repeated values (the e1 cases of the martingale tests).
+    """
+    values = ob_df[column].to_numpy()
+    changed = np.ones(len(values), dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    # Each kept snapshot closes the bar of the repeated values before the next change
+    starts = np.flatnonzero(changed)
+    bars_df = ob_df.iloc[starts].copy()
+    bars_df["Snapshots"] = np.diff(np.append(starts, len(values)))
+    return bars_df
+
+
+def resample(ob_df: pd.DataFrame = None, sampling: str = "clock", parameter=None):
+    """
+    Shared sampling layer
+    Samples the df_metrics DataFrame in clock or event time, without going back to the
+    snapshots. The result keeps the df_metrics columns (plus Snapshots, the snapshots of
+    every bar), so every model can run on any sampling:
+
+    -clock : Metrics at the end of every period of parameter ("1s" by default)
+    -tick : Every parameter-th snapshot (100 by default)
+    -volume : Every parameter units of cumulative Total Volume
+    -change : Only the snapshots where parameter changes ("Mid Price" by default)
+
+    Parameters
+    ----------
+    ob_df (DataFrame) : df_metrics DataFrame
+    sampling (str) : clock, tick, volume or change, a "sampling:parameter" string (such as
+    "tick:50" or "clock:5s") is accepted
+    parameter : Parameter of the sampling
+
+    Returns
+    -------
+    bars_df (DataFrame) : Sampled metrics
+    """
+    if ":" in sampling:
+        sampling, parameter = sampling.split(":", 1)
+    if sampling not in samplings:
+        raise ValueError("Unknown sampling {!r}, use one of {}".format(sampling, ", ".join(samplings)))
+    parameter = samplings[sampling] if parameter is None else parameter
+    if sampling == "clock":
+        return clock_bars(ob_df, parameter)
+    if sampling == "tick":
+        return tick_bars(ob_df, int(parameter))
+    if sampling == "volume":
+        return volume_bars(ob_df, None if parameter is None else float(parameter))
+    return change_bars(ob_df, parameter)
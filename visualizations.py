@@ -9,58 +9,172 @@
 # -- --------------------------------------------------------------------------------------------------- -- #
 """
 
+import os
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.io as pio
-pio.renderers.keys()
 import pandas as pd
-import functions as ft
 import numpy as np
-import data as dt
 
-def APT_graph(df: pd.DataFrame = None) -> True:
+# Largest number of points drawn per line, longer series are downsampled
+max_points = 5000
+# From this number of points lines are drawn with WebGL (Scattergl)
+webgl_points = 1000
+
+
+def _as_numbers(x=None):
+    # int64 nanoseconds for datetimes, float for the rest
+    if isinstance(x, pd.DatetimeIndex) or np.issubdtype(np.asarray(x).dtype, np.datetime64):
+        return pd.DatetimeIndex(x).asi8.astype(np.float64)
+    return np.asarray(x, dtype=np.float64)
+
+
+def lttb(x=None, y=None, n_out: int = max_points):
     """
-    APT Experiment 2 Type graph.
-    Plots Stacked Bars for each minute, displays in different colors the succesful martingale
-    prediction and the unsuccesful, one for each minute of trade.
+    Largest-Triangle-Three-Buckets downsampling
+    Keeps the first and last points and, from each of n_out - 2 equal buckets, the point
+    that forms the largest triangle with the point kept in the previous bucket and the
+    mean of the next bucket. It preserves the visual shape of a line with n_out points.
 
     Parameters
     ----------
-    data (DataFrame) : DataFrame containing the asset pricing theory evaluation.
+    x (array) : x values (numbers or datetimes), sorted
+    y (array) : y values
+    n_out (int) : Number of points kept
 
     Returns
     -------
-    fig : Experiment 2 Graph
+    positions (np.ndarray) : Positions of the kept points
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x, y = _as_numbers(x), np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    positions = np.empty(n_out, dtype=np.int64)
+    positions[0], positions[-1] = 0, n - 1
+    previous = 0
+    for i_bucket in range(n_out - 2):
+        start, end = edges[i_bucket], edges[i_bucket + 1]
+        next_end = edges[i_bucket + 2] if i_bucket + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), np.nanmean(y[end:next_end])
+        # Twice the area of the triangles (previous point, candidate, next bucket mean)
+        area = np.abs((x[previous] - next_x)*(y[start:end] - y[previous])
+                      - (x[previous] - x[start:end])*(next_y - y[previous]))
+        previous = start + int(np.nanargmax(area)) if not np.all(np.isnan(area)) else start
+        positions[i_bucket + 1] = previous
+    return positions
+
+
+def minmax(y=None, n_out: int = max_points):
+    """
+    Min/max downsampling
+    Splits the series into n_out/2 equal buckets (one per pixel column) and keeps the
+    minimum and the maximum of each, so spikes are never lost.
+
+    Parameters
+    ----------
+    y (array) : y values
+    n_out (int) : Number of points kept (about)
+
+    Returns
+    -------
+    positions (np.ndarray) : Sorted positions of the kept points
     """
-    
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    starts = np.linspace(0, n, max(n_out//2, 1) + 1).astype(np.int64)[:-1]
+    lengths = np.diff(np.append(starts, n))
+    # Bucket of every point, then the position of the smallest and largest value of each
+    buckets = np.repeat(np.arange(len(starts)), lengths)
+    filled = np.where(np.isnan(y), np.inf, y)
+    order = np.lexsort((filled, buckets))
+    ends = np.cumsum(lengths)
+    positions = np.concatenate([order[starts], order[ends - 1]])
+    return np.unique(positions)
+
+
+def _line(x=None, y=None, name: str = None, method: str = "minmax", n_out: int = max_points):
+    """
+    Line trace of a series of any length: downsampled to n_out points (lttb or minmax,
+    None to keep every point) and drawn with Scattergl when many points are left.
+    """
+    y = np.asarray(y)
+    if method is not None and len(y) > n_out:
+        positions = lttb(x, y, n_out) if method == "lttb" else minmax(y, n_out)
+        x = (x if isinstance(x, pd.Index) else np.asarray(x))[positions]
+        y = y[positions]
+    trace = go.Scattergl if len(y) > webgl_points else go.Scatter
+    return trace(x=x, y=y, name=name, mode="lines")
+
+
+def save_figure(fig=None, filename: str = None):
+    """
+    Writes a figure straight to a file, without opening it: .html files are written with
+    plotly.js loaded from its CDN, any other extension (.png, .svg, .pdf) as a static image
+    (requires the kaleido package).
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if filename.lower().endswith(".html"):
+        fig.write_html(filename, include_plotlyjs="cdn")
+    else:
+        fig.write_image(filename)
+    return filename
+
+
+def _APT_bars(df: pd.DataFrame = None, title: str = None):
+    # Stacked bars of the martingale counts of every bucket, the x axis comes from the buckets
+    x = df.index if isinstance(df.index, pd.DatetimeIndex) else np.arange(len(df))
     fig = go.Figure(
         data = [
             go.Bar(
                 name = "Succesful Martingale Prediction",
-                x = np.arange(0,61),
+                x = x,
                 y = df["e1"],
                 offsetgroup=0,
-                text = df["e1"]
+                text = df["e1"] if len(df) <= 120 else None
             ),
             go.Bar(
                 name = "Unsuccesful Martingale Prediction",
-                x = np.arange(0,61),
+                x = x,
                 y = df["e2"],
                 offsetgroup=0,
                 base = df["e1"],
-                text = df["e2"]
+                text = df["e2"] if len(df) <= 120 else None
             )
         ]
     )
-    
+
     fig.update_layout(
-        xaxis_title = "Minute",
+        xaxis_title = "Time" if isinstance(df.index, pd.DatetimeIndex) else "Minute",
         yaxis_title = "Martingale Count",
         legend_title = "Martingale Prediction",
-        title = "Asset Pricing Theory, Experiment 2"
+        title = title
     )
     return fig
 
+
+def APT_graph(df: pd.DataFrame = None) -> True:
+    """
+    APT Experiment 2 Type graph.
+    Plots Stacked Bars for each minute, displays in different colors the succesful martingale
+    prediction and the unsuccesful, one for each minute of trade.
+
+    Parameters
+    ----------
+    data (DataFrame) : DataFrame containing the asset pricing theory evaluation.
+
+    Returns
+    -------
+    fig : Experiment 2 Graph
+    """
+    return _APT_bars(df, "Asset Pricing Theory, Experiment 2")
+
+
 def APT_graph_w(df: pd.DataFrame = None) -> True:
     """
     APT Experiment 3 Type graph.
@@ -75,37 +189,10 @@ def APT_graph_w(df: pd.DataFrame = None) -> True:
     -------
     fig : Experiment 2 Graph
     """
-    
-    fig = go.Figure(
-        data = [
-            go.Bar(
-                name = "Succesful Martingale Prediction",
-                x = np.arange(0,61),
-                y = df["e1"],
-                offsetgroup=0,
-                text = df["e1"]
-            ),
-            go.Bar(
-                name = "Unsuccesful Martingale Prediction",
-                x = np.arange(0,61),
-                y = df["e2"],
-                offsetgroup=0,
-                base = df["e1"],
-                text = df["e2"]
-            )
-        ]
-    )
-    
-    fig.update_layout(
-        xaxis_title = "Minute",
-        yaxis_title = "Martingale Count",
-        legend_title = "Martingale Prediction",
-        title = "Asset Pricing Theory, Experiment 3 (Weighted Mid Prices)"
-    )
-    return fig
-    
+    return _APT_bars(df, "Asset Pricing Theory, Experiment 3 (Weighted Mid Prices)")
+
 
-def Model2_TS_observed(df: pd.DataFrame = None) -> True:
+def Model2_TS_observed(df: pd.DataFrame = None, method: str = "minmax", n_out: int = max_points) -> True:
     """
     Plots Line plot comparing actual spread vs calculated spread and histogram showing
     the distribution of the spread.
@@ -113,6 +200,8 @@ def Model2_TS_observed(df: pd.DataFrame = None) -> True:
     Parameters
     ----------
     df (DataFrame) :
+    method (str) : Downsampling of long series, "minmax", "lttb" or None
+    n_out (int) : Largest number of points per line
 
     Returns
     -------
@@ -121,21 +210,9 @@ def Model2_TS_observed(df: pd.DataFrame = None) -> True:
     """
     fig = go.Figure(
         data = [
-            go.Scatter(
-                x = df.index,
-                y = df["Bid"],
-                name = "Bid"                
-            ),
-            go.Scatter(
-                x = df.index,
-                y = df["Mid"],
-                name = "Mid Price"
-            ),
-            go.Scatter(
-                x = df.index,
-                y = df["Ask"],
-                name = "Ask"
-            )
+            _line(df.index, df["Bid"], "Bid", method, n_out),
+            _line(df.index, df["Mid"], "Mid Price", method, n_out),
+            _line(df.index, df["Ask"], "Ask", method, n_out)
         ]
     )
     fig.update_layout(
@@ -146,7 +223,7 @@ def Model2_TS_observed(df: pd.DataFrame = None) -> True:
     )
     return fig
 
-def Model2_TS_Theoretical(df: pd.DataFrame = None) -> True:
+def Model2_TS_Theoretical(df: pd.DataFrame = None, method: str = "minmax", n_out: int = max_points) -> True:
     """
     Plots Line plot comparing actual spread vs calculated spread and histogram showing
     the distribution of the spread.
@@ -154,6 +231,8 @@ def Model2_TS_Theoretical(df: pd.DataFrame = None) -> True:
     Parameters
     ----------
     df (DataFrame) : DataFrame containing the results for the roll model evaluation of the data
+    method (str) : Downsampling of long series, "minmax", "lttb" or None
+    n_out (int) : Largest number of points per line
 
     Returns
     -------
@@ -162,21 +241,9 @@ def Model2_TS_Theoretical(df: pd.DataFrame = None) -> True:
     """
     fig = go.Figure(
         data = [
-            go.Scatter(
-                x = df.index,
-                y = df["Calc Bid"],
-                name = "Theoretical Bid"                
-            ),
-            go.Scatter(
-                x = df.index,
-                y = df["Mid"],
-                name = "Mid Price"
-            ),
-            go.Scatter(
-                x = df.index,
-                y = df["Calc Ask"],
-                name = "Theoretical Ask"
-            )
+            _line(df.index, df["Calc Bid"], "Theoretical Bid", method, n_out),
+            _line(df.index, df["Mid"], "Mid Price", method, n_out),
+            _line(df.index, df["Calc Ask"], "Theoretical Ask", method, n_out)
         ]
     )
     fig.update_layout(
@@ -186,4 +253,3 @@ def Model2_TS_Theoretical(df: pd.DataFrame = None) -> True:
         title = "Roll Model - Theoretical Prices "
     )
     return fig
-    
\ No newline at end of file